@@ -23,11 +23,30 @@ def custom_openapi() -> Dict:
             ## WebSocket Connections
             Real-time communication is handled through WebSocket connections. Connect
             to `/api/v1/chat/ws/{client_id}` with a valid token to establish a connection.
+            Send `{"type": "chat_message", "content": "...", "stream": true}` to receive the
+            answer as `chat_response_delta` frames followed by a `chat_response_done` frame
+            with the full text. Requests are handled concurrently (up to a per-connection
+            limit); include a `request_id` to correlate responses, which always carry one,
+            and send `{"type": "cancel", "request_id": "..."}` to stop a generation.
+            Send `{"type": "subscribe_progress", "document_ids": [...]}` to receive
+            `processing_progress` frames as documents are OCR'd and analyzed, including
+            partial analysis results; the same data can be polled at
+            `GET /api/v1/documents/{document_id}/progress`.
+            Send `{"type": "join_room", "room_type": "conversation" | "document", "room_id": "..."}`
+            to receive `presence` and `typing_status` frames for that room only; typing
+            updates are coalesced into at most one frame per room every few hundred ms.
             
             ## Rate Limiting
             API requests are rate-limited to:
-            - 100 requests per minute for REST endpoints
+            - 100 requests per minute for REST endpoints, per authenticated user
+              (per client address for anonymous requests)
             - 60 messages per minute for WebSocket connections
+            
+            REST requests over the limit receive `429 Too Many Requests` with a
+            `Retry-After` header. WebSocket messages over the limit are answered with an
+            `error` frame (`"code": "rate_limited"`, `retry_after` in seconds); clients that
+            keep sending are disconnected with close code 1008. Typing and cancel messages
+            are not counted.
             """,
             "version": "1.0.0",
             "contact": {
@@ -2,9 +2,14 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from dotenv import load_dotenv
+import asyncio
 import logging
 from .docs.openapi_docs import custom_openapi
 from .middleware.validation import RequestValidationMiddleware
+from .middleware.rate_limit import RateLimitMiddleware
+from .services.mistral_service import close_mistral_client
+from .services.ocr_service import shutdown_ocr_pool
+from .services.cache_service import get_cache_service
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.staticfiles import StaticFiles
 
@@ -23,6 +28,10 @@ app = FastAPI(
     redoc_url=None  # Disable default redoc
 )
 
+# Limit each client to RATE_LIMIT_PER_MINUTE requests. Added before CORS so
+# that CORS wraps it: 429 responses get CORS headers and preflights pass
+app.add_middleware(RateLimitMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -55,6 +64,14 @@ app.openapi = custom_openapi
 async def health_check():
     return {"status": "healthy"}
 
+@app.on_event("shutdown")
+async def shutdown_clients():
+    # Tells other nodes this node's WebSocket clients are gone
+    await chat.manager.close()
+    await close_mistral_client()
+    await get_cache_service().close()
+    await asyncio.to_thread(shutdown_ocr_pool)
+
 # Include routers
 from .routers import documents, chat, auth
 
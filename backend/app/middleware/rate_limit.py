@@ -0,0 +1,66 @@
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from typing import Optional, Tuple
+import os
+import math
+import logging
+from jose import JWTError, jwt
+from ..services.rate_limiter import get_request_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """
+    Token-bucket rate limiting of REST requests per client, answering
+    429 with a Retry-After header once a client exceeds its limit
+    """
+
+    def __init__(
+        self,
+        app,
+        per_minute: Optional[int] = None,
+        exempt_paths: Tuple[str, ...] = ("/health", "/docs", "/openapi.json", "/static")
+    ):
+        super().__init__(app)
+        self.per_minute = per_minute or int(os.getenv("RATE_LIMIT_PER_MINUTE", "100"))
+        self.exempt_paths = exempt_paths
+        self.limiter = get_request_rate_limiter("rest", self.per_minute)
+        # Tokens are verified here without the route's database lookup
+        self.secret_key = os.getenv("SECRET_KEY")
+        self.algorithm = os.getenv("ALGORITHM", "HS256")
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        # CORS preflights carry no credentials and must not use up the client's budget
+        if request.method == "OPTIONS" or request.url.path.startswith(self.exempt_paths):
+            return await call_next(request)
+
+        retry_after = await self.limiter.acquire(self._client_key(request))
+        if retry_after > 0:
+            logger.warning(f"Rate limit exceeded for {request.method} {request.url.path}")
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded"},
+                headers={
+                    "Retry-After": str(math.ceil(retry_after)),
+                    "X-RateLimit-Limit": str(self.per_minute)
+                }
+            )
+        return await call_next(request)
+
+    def _client_key(self, request: Request) -> str:
+        """
+        Identify the client by the subject of a validly signed, unexpired
+        token, falling back to its address. Unverified credentials are
+        ignored, so made-up tokens cannot be used to get a fresh bucket per
+        request.
+        """
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token and self.secret_key:
+            try:
+                subject = jwt.decode(token, self.secret_key, algorithms=[self.algorithm]).get("sub")
+                if subject:
+                    return f"user:{subject}"
+            except JWTError:
+                pass
+        return "ip:" + (request.client.host if request.client else "unknown")
@@ -1,6 +1,7 @@
 from sqlalchemy import Column, String, ForeignKey, JSON, Enum as SQLEnum
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.mutable import MutableDict
 import uuid
 import enum
 from .base import Base, TimestampMixin, SoftDeleteMixin
@@ -33,10 +34,12 @@ class Document(Base, TimestampMixin, SoftDeleteMixin):
     file_path = Column(String, nullable=False)
     file_size = Column(String, nullable=False)
     file_type = Column(String, nullable=False)
+    file_hash = Column(String(64), nullable=True, index=True)
     
-    # Meta information
-    metadata = Column(JSON, nullable=True)
-    analysis_results = Column(JSON, nullable=True)
+    # Meta information; MutableDict tracks in-place key assignment, so
+    # document.metadata['key'] = value is saved like any other change
+    metadata = Column(MutableDict.as_mutable(JSON), nullable=True)
+    analysis_results = Column(MutableDict.as_mutable(JSON), nullable=True)
     
     # Relations
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
@@ -53,12 +56,11 @@ class Document(Base, TimestampMixin, SoftDeleteMixin):
     def update_status(self, status: DocumentStatus):
         """Update document status and track in metadata"""
         self.status = status
-        if 'status_history' not in self.metadata:
-            self.metadata['status_history'] = []
-        self.metadata['status_history'].append({
+        # Reassign rather than append: nested mutations are not tracked
+        self.metadata['status_history'] = self.metadata.get('status_history', []) + [{
             'status': status.value,
             'timestamp': str(self.updated_at)
-        })
+        }]
 
     def add_analysis_result(self, analysis_type: str, result: dict):
         """Add or update analysis result"""
@@ -103,6 +105,7 @@ class Document(Base, TimestampMixin, SoftDeleteMixin):
             'file_path': self.file_path,
             'file_size': self.file_size,
             'file_type': self.file_type,
+            'file_hash': self.file_hash,
             'metadata': self.metadata,
             'analysis_results': self.analysis_results,
             'created_at': str(self.created_at),
@@ -1,17 +1,147 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import List, Dict
+from typing import Coroutine, List, Dict, Optional
+import os
 import json
-from ..dependencies import get_current_user
+import uuid
+import asyncio
+import logging
+from ..dependencies import get_current_user, get_db
 from ..services.chat_service import ChatService
 from ..services.connection_manager import ConnectionManager
+from ..services.document_service import DocumentService
+from ..services.cache_service import get_cache_service
+from ..services.progress import ProgressSubscriber
+from ..services.rate_limiter import get_request_rate_limiter
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 manager = ConnectionManager()
+# Limits the messages each user sends across all their connections
+ws_rate_limiter = get_request_rate_limiter("ws", int(os.getenv("WS_RATE_LIMIT_PER_MINUTE", "60")))
+# Close code for clients that keep sending after being told to slow down
+POLICY_VIOLATION_CLOSE_CODE = 1008
+# Message types that are never rate limited: cheap, or reduce load
+UNLIMITED_MESSAGE_TYPES = ("typing", "cancel")
 
 class ChatWebSocket:
+    """
+    Per-connection state. Requests run as their own tasks, so the receive loop
+    keeps reading typing updates, cancellations and further questions while
+    a generation is in flight.
+    """
+
     def __init__(self, websocket: WebSocket, user_id: str):
         self.websocket = websocket
         self.user_id = user_id
+        self.max_concurrent_requests = int(os.getenv("WS_MAX_CONCURRENT_REQUESTS", "4"))
+        self.requests: Dict[str, asyncio.Task] = {}
+        # Consecutive rate-limited messages tolerated before the connection is closed
+        self.max_rate_limit_violations = int(os.getenv("WS_RATE_LIMIT_MAX_VIOLATIONS", "10"))
+        self.rate_limit_violations = 0
+
+    async def send(self, message: dict, request_id: Optional[str] = None):
+        """
+        Send a message, tagged with the request it answers
+        """
+        if request_id:
+            message = {**message, "request_id": request_id}
+        await manager.send_personal_message(message=message, websocket=self.websocket)
+
+    async def check_rate_limit(self, request_id: str) -> bool:
+        """
+        Charge a message to the user's rate limit; False if it must be dropped
+        """
+        retry_after = await ws_rate_limiter.acquire(self.user_id)
+        if retry_after == 0:
+            self.rate_limit_violations = 0
+            return True
+        self.rate_limit_violations += 1
+        await self.send({
+            "type": "error",
+            "code": "rate_limited",
+            "content": "Rate limit exceeded",
+            "retry_after": round(retry_after, 1)
+        }, request_id)
+        return False
+
+    async def dispatch(self, request_id: str, handler: Coroutine):
+        """
+        Run a request handler in the background, within the per-connection limit
+        """
+        if request_id in self.requests or len(self.requests) >= self.max_concurrent_requests:
+            handler.close()
+            reason = "Duplicate request id" if request_id in self.requests else "Too many concurrent requests"
+            await self.send({"type": "error", "content": reason}, request_id)
+            return
+        self.requests[request_id] = asyncio.create_task(self._run(request_id, handler))
+
+    async def _run(self, request_id: str, handler: Coroutine):
+        try:
+            await handler
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error handling request {request_id}: {str(e)}")
+            await self.send({"type": "error", "content": str(e)}, request_id)
+        finally:
+            self.requests.pop(request_id, None)
+
+    async def cancel(self, request_id: str):
+        """
+        Cancel an in-flight request, stopping its generation
+        """
+        task = self.requests.get(request_id)
+        if task:
+            task.cancel()
+            await self.send({"type": "cancelled"}, request_id)
+
+    def cancel_all(self):
+        for task in list(self.requests.values()):
+            task.cancel()
+
+async def stream_chat_response(session: ChatWebSocket, chat_service: ChatService, user, request_id: str, content: str):
+    """
+    Stream the response as it is generated, then send the full text
+    """
+    parts = []
+    async for delta in chat_service.stream_message(user_id=user.id, message=content):
+        parts.append(delta)
+        await session.send({"type": "chat_response_delta", "content": delta}, request_id)
+    await session.send({"type": "chat_response_done", "content": "".join(parts)}, request_id)
+
+async def chat_response(session: ChatWebSocket, chat_service: ChatService, user, request_id: str, content: str):
+    response = await chat_service.process_message(user_id=user.id, message=content)
+    await session.send({"type": "chat_response", "content": response}, request_id)
+
+async def document_analysis_response(session: ChatWebSocket, chat_service: ChatService, user, request_id: str, document_id: str):
+    analysis = await chat_service.analyze_document(user_id=user.id, document_id=document_id)
+    await session.send({"type": "analysis_response", "content": analysis}, request_id)
+
+async def readable_document_ids(user, document_ids: List[str]) -> List[str]:
+    """
+    Filter document ids down to those the user may read
+    """
+    db = next(get_db())
+    try:
+        document_service = DocumentService(db)
+        return [
+            document_id for document_id in document_ids
+            if await document_service.get_document(document_id, user)
+        ]
+    finally:
+        db.close()
+
+async def can_join_room(user, chat_service: ChatService, room_type: str, room_id: str) -> bool:
+    """
+    Check that the user may see presence and typing in a conversation or document room
+    """
+    if room_type == "document":
+        return bool(await readable_document_ids(user, [room_id]))
+    if room_type == "conversation":
+        history = await chat_service.get_conversation_history(user_id=user.id, conversation_id=room_id)
+        return history is not None
+    return False
 
 @router.websocket("/ws/{client_id}")
 async def websocket_endpoint(
@@ -22,53 +152,130 @@ async def websocket_endpoint(
     try:
         # Verify token and get user
         user = await get_current_user(token)
-        await manager.connect(websocket, client_id)
-        
-        chat_service = ChatService()
-        
-        try:
-            while True:
-                data = await websocket.receive_text()
+        await manager.connect(websocket, client_id, str(user.id))
+    except Exception as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+
+    chat_service = ChatService()
+    cache = get_cache_service()
+    session = ChatWebSocket(websocket, str(user.id))
+
+    async def send_progress(document_id: str, progress: dict):
+        await manager.send_personal_message(
+            message={"type": "processing_progress", "document_id": document_id, "progress": progress},
+            websocket=websocket
+        )
+
+    progress_subscriber = ProgressSubscriber(cache, send_progress)
+
+    try:
+        while True:
+            data = await websocket.receive_text()
+            request_id = None
+            try:
                 message_data = json.loads(data)
-                
+                if not isinstance(message_data, dict) or "type" not in message_data:
+                    raise ValueError("Message must be a JSON object with a type")
+
+                # Responses echo the client's request_id, or one assigned here
+                request_id = str(message_data.get("request_id") or uuid.uuid4().hex)
+
+                if message_data["type"] not in UNLIMITED_MESSAGE_TYPES:
+                    if not await session.check_rate_limit(request_id):
+                        if session.rate_limit_violations >= session.max_rate_limit_violations:
+                            manager.disconnect(websocket, client_id)
+                            await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE, reason="Rate limit exceeded")
+                            return
+                        continue
+
                 # Process different types of messages
                 if message_data["type"] == "chat_message":
-                    # Handle regular chat message
-                    response = await chat_service.process_message(
-                        user_id=user.id,
-                        message=message_data["content"]
-                    )
-                    await manager.send_personal_message(
-                        message={"type": "chat_response", "content": response},
-                        websocket=websocket
+                    # Handle chat message, streamed if requested
+                    handler = stream_chat_response if message_data.get("stream") else chat_response
+                    await session.dispatch(
+                        request_id,
+                        handler(session, chat_service, user, request_id, message_data["content"])
                     )
-                
+
                 elif message_data["type"] == "document_analysis":
                     # Handle document analysis request
-                    analysis = await chat_service.analyze_document(
-                        user_id=user.id,
-                        document_id=message_data["document_id"]
+                    await session.dispatch(
+                        request_id,
+                        document_analysis_response(session, chat_service, user, request_id, message_data["document_id"])
                     )
-                    await manager.send_personal_message(
-                        message={"type": "analysis_response", "content": analysis},
-                        websocket=websocket
+
+                elif message_data["type"] == "cancel":
+                    # Stop an in-flight generation the user no longer wants
+                    await session.cancel(request_id)
+
+                elif message_data["type"] == "subscribe_progress":
+                    # Push processing progress of these documents, starting with their current state
+                    document_ids = await readable_document_ids(user, message_data["document_ids"])
+                    if document_ids:
+                        await progress_subscriber.subscribe(document_ids)
+                    statuses = await cache.get_many_processing_status(document_ids)
+                    for document_id, progress in statuses.items():
+                        if progress:
+                            await send_progress(document_id, progress)
+
+                elif message_data["type"] == "unsubscribe_progress":
+                    await progress_subscriber.unsubscribe(message_data["document_ids"])
+
+                elif message_data["type"] == "join_room":
+                    room_type, room_id = message_data["room_type"], str(message_data["room_id"])
+                    if await can_join_room(user, chat_service, room_type, room_id):
+                        await manager.join_room(client_id, f"{room_type}:{room_id}")
+                    else:
+                        await manager.send_personal_message(
+                            message={"type": "error", "content": f"Cannot join {room_type} {room_id}"},
+                            websocket=websocket
+                        )
+
+                elif message_data["type"] == "leave_room":
+                    await manager.leave_room(
+                        client_id,
+                        f"{message_data['room_type']}:{message_data['room_id']}"
                     )
-                
+
                 elif message_data["type"] == "typing":
-                    # Handle typing indicator
+                    # Handle typing indicator, scoped to the given room or all joined rooms
+                    room = None
+                    if message_data.get("room_type"):
+                        room = f"{message_data['room_type']}:{message_data['room_id']}"
                     await manager.broadcast_typing(
                         client_id,
-                        message_data["is_typing"]
+                        message_data["is_typing"],
+                        room
                     )
 
-        except WebSocketDisconnect:
-            manager.disconnect(websocket, client_id)
-            await manager.broadcast_message(
-                f"Client #{client_id} left the chat"
-            )
-            
-    except Exception as e:
-        await websocket.close(code=1008, reason=str(e))
+                else:
+                    raise ValueError(f"Unknown message type: {message_data['type']}")
+
+            # A bad frame only fails itself; the connection stays open
+            except json.JSONDecodeError:
+                await session.send({"type": "error", "code": "invalid_message", "content": "Invalid JSON"})
+            except KeyError as e:
+                await session.send(
+                    {"type": "error", "code": "invalid_message", "content": f"Missing field {e}"},
+                    request_id
+                )
+            except (ValueError, TypeError) as e:
+                await session.send({"type": "error", "code": "invalid_message", "content": str(e)}, request_id)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"Error handling WebSocket message from {client_id}: {str(e)}")
+                await session.send({"type": "error", "content": "Could not process message"}, request_id)
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        # Leaving announces this client's departure to the rooms it had joined
+        manager.disconnect(websocket, client_id)
+        session.cancel_all()
+        await progress_subscriber.close()
 
 @router.get("/history/{conversation_id}")
 async def get_chat_history(
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional
 from pydantic import BaseModel, UUID4
 from datetime import datetime
 from ..dependencies import get_current_user, get_db
-from ..models.document import Document
+from ..models.document import Document, DocumentType
 from ..services.document_service import DocumentService
+from ..services.cache_service import get_cache_service
+from ..services.batch_ingest import BatchIngestService, BatchIngestError
 
 router = APIRouter()
 
@@ -45,6 +48,70 @@ async def create_document(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/batch", status_code=202)
+async def create_documents_batch(
+    files: List[UploadFile] = File(...),
+    document_type: DocumentType = Form(DocumentType.OTHER),
+    current_user = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Upload many documents at once, as individual files and/or zip archives, and
+    queue them all for analysis. Poll the returned batch id for progress.
+    """
+    try:
+        return await BatchIngestService(db).ingest(files, document_type, current_user)
+    except BatchIngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/batch/{batch_id}")
+async def get_documents_batch(
+    batch_id: str,
+    current_user = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Get the processing progress of a batch upload.
+    """
+    status = await BatchIngestService(db).get_status(batch_id, current_user)
+    if not status:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
+@router.get("/status")
+async def get_documents_status(
+    document_ids: List[UUID4] = Query(..., max_items=100),
+    analysis_type: str = "complete",
+    current_user = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Get cached processing status and analysis results for many documents at once.
+    """
+    ids = [str(document_id) for document_id in document_ids]
+
+    def readable_ids():
+        return {
+            str(document.id)
+            for document in db.query(Document).filter(Document.id.in_(ids), Document.deleted_at.is_(None))
+            if current_user.has_permission('read', document)
+        }
+
+    # The query is synchronous, so keep it off the event loop
+    readable = await run_in_threadpool(readable_ids)
+    ids = [document_id for document_id in ids if document_id in readable]
+
+    cache = get_cache_service()
+    statuses = await cache.get_many_processing_status(ids)
+    analyses = await cache.get_many_analysis_cache(ids, analysis_type)
+    return {
+        document_id: {
+            "processing_status": statuses.get(document_id),
+            "analysis": analyses.get(document_id)
+        }
+        for document_id in ids
+    }
+
 @router.get("/{document_id}", response_model=DocumentResponse)
 async def get_document(
     document_id: UUID4,
@@ -60,6 +127,26 @@ async def get_document(
         raise HTTPException(status_code=404, detail="Document not found")
     return document
 
+@router.get("/{document_id}/progress")
+async def get_document_progress(
+    document_id: UUID4,
+    current_user = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """
+    Get fine-grained processing progress of a document, including any
+    analysis results completed so far.
+    """
+    document_service = DocumentService(db)
+    document = await document_service.get_document(document_id, current_user)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    progress = await get_cache_service().get_processing_status(str(document_id))
+    if not progress:
+        return {"document_id": str(document_id), "stage": document.status.value}
+    return progress
+
 @router.get("/", response_model=List[DocumentResponse])
 async def list_documents(
     skip: int = Query(0, ge=0),
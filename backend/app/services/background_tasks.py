@@ -1,11 +1,19 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Coroutine, List
 import asyncio
-from celery import Celery
-from celery.result import AsyncResult
+import threading
+import uuid
+from datetime import timedelta
+from celery import Celery, chain, group
+from celery.result import AsyncResult, GroupResult
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from sqlalchemy.orm import Session
 import logging
 from .document_processor import DocumentProcessor
-from .cache_service import CacheService
-from ..models.document import Document, DocumentStatus
+from .cache_service import LeaseError, get_cache_service
+from .mistral_service import close_mistral_client
+from .ocr_service import shutdown_ocr_pool
+from .single_flight import SingleFlight
+from ..models.document import Document
 from ..database import get_db
 import os
 from dotenv import load_dotenv
@@ -20,84 +28,341 @@ celery_app = Celery(
     backend=os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/1')
 )
 
+# Pipeline stages get their own queues so CPU-bound extraction/OCR workers and
+# I/O-bound LLM workers can be sized independently, e.g.
+#   celery -A app.services.background_tasks worker -Q document_extract,document_ocr -P prefork -c <cores>
+#   celery -A app.services.background_tasks worker -Q document_analysis,document_persist -P threads -c 64
 celery_app.conf.task_routes = {
-    'document_processing': {'queue': 'document_processing'},
-    'document_comparison': {'queue': 'document_comparison'}
+    'document_comparison': {'queue': 'document_comparison'},
+    'document_pipeline.extract': {'queue': 'document_extract'},
+    'document_pipeline.ocr': {'queue': 'document_ocr'},
+    'document_pipeline.chunk': {'queue': 'document_extract'},
+    'document_pipeline.analyze': {'queue': 'document_analysis'},
+    'document_pipeline.persist': {'queue': 'document_persist'}
 }
 
-class BackgroundTaskService:
-    def __init__(self):
-        self.cache = CacheService()
+# Tasks only block their worker thread while their coroutine runs on the shared
+# event loop, so a thread pool lets one process overlap many LLM calls. OCR
+# workers should override this with -P prefork to use every core.
+celery_app.conf.worker_pool = os.getenv('CELERY_WORKER_POOL', 'threads')
+celery_app.conf.worker_concurrency = int(os.getenv('CELERY_WORKER_CONCURRENCY', '32'))
 
-    @celery_app.task(name='document_processing')
-    def process_document_task(self, document_id: str):
-        """
-        Celery task for document processing
-        """
-        try:
-            db = next(get_db())
-            document = db.query(Document).filter(Document.id == document_id).first()
-            if not document:
-                raise ValueError(f"Document not found: {document_id}")
+# OCR processes per task. Worker concurrency already spreads OCR over the
+# cores, so tasks OCR in-process by default instead of each starting a pool
+# of OCR_WORKERS processes (prefork children cannot start one anyway).
+TASK_OCR_WORKERS = int(os.getenv('CELERY_OCR_WORKERS', '1'))
 
-            processor = DocumentProcessor(db)
-            loop = asyncio.get_event_loop()
-            
-            # Process document
-            result = loop.run_until_complete(
-                processor.process_document(document, document.file_path)
-            )
+# How long a pipeline may hold a document's processing lease without
+# renewing it; stages renew it as they start, so it spans queue waits too
+PIPELINE_LEASE_TTL = timedelta(seconds=int(os.getenv('PIPELINE_LEASE_SECONDS', '3600')))
 
-            # Cache results
-            loop.run_until_complete(
-                self.cache.set_analysis_cache(
-                    document_id,
-                    "complete",
-                    result
-                )
-            )
 
-            return result
+# Persistent event loop of this worker process, run in a background thread
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_loop_lock = threading.Lock()
+_single_flight: Optional[SingleFlight] = None
 
-        except Exception as e:
-            logger.error(f"Error in background processing: {str(e)}")
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get this process's worker event loop, starting it on first use
+    """
+    global _worker_loop
+    with _worker_loop_lock:
+        if _worker_loop is None or _worker_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="worker-event-loop", daemon=True)
+            thread.start()
+            _worker_loop = loop
+        return _worker_loop
+
+
+def run_async(coroutine: Coroutine) -> Any:
+    """
+    Run a coroutine on the worker event loop and wait for its result
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_worker_loop()).result()
+
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight(get_cache_service())
+    return _single_flight
+
+
+@worker_process_init.connect
+def start_worker_loop(**kwargs):
+    # A forked child must not reuse the parent's loop or its connections
+    global _worker_loop
+    _worker_loop = None
+    get_worker_loop()
+
+
+# Pool processes (prefork) get worker_process_shutdown; the loop of a threads
+# or solo pool lives in the main worker process, which only gets worker_shutdown
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def stop_worker_loop(**kwargs):
+    global _worker_loop
+    shutdown_ocr_pool()
+    with _worker_loop_lock:
+        loop, _worker_loop = _worker_loop, None
+    if loop is None or loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_mistral_client(), loop).result()
+        asyncio.run_coroutine_threadsafe(get_cache_service().close(), loop).result()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+# A lease error leaves unknown whether another pipeline has the document, so retry rather than skip it
+@celery_app.task(
+    name='document_pipeline.extract',
+    autoretry_for=(LeaseError,),
+    retry_backoff=True,
+    max_retries=int(os.getenv('PIPELINE_LEASE_RETRIES', '5'))
+)
+def extract_stage_task(document_id: str, processing_token: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Pipeline stage: validate, hash and deduplicate a document, then read its text layer
+    """
+    return run_async(start_pipeline(document_id, processing_token))
+
+
+@celery_app.task(name='document_pipeline.ocr')
+def ocr_stage_task(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pipeline stage: OCR pages without a text layer
+    """
+    return run_async(run_pipeline_stage("ocr_missing_pages", state))
+
+
+@celery_app.task(name='document_pipeline.chunk')
+def chunk_stage_task(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pipeline stage: chunk long texts for map-reduce analysis
+    """
+    return run_async(run_pipeline_stage("chunk_text", state))
+
+
+@celery_app.task(name='document_pipeline.analyze')
+def analyze_stage_task(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pipeline stage: run the LLM analyses
+    """
+    return run_async(run_pipeline_stage("analyze_text", state))
+
+
+@celery_app.task(name='document_pipeline.persist')
+def persist_stage_task(state: Dict[str, Any], schedule_token: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Pipeline stage: save the analysis results
+    """
+    return run_async(finish_pipeline(state, schedule_token))
+
+
+@celery_app.task(name='document_pipeline.failed')
+def pipeline_failed_task(
+    request,
+    exc,
+    traceback,
+    document_id: str,
+    schedule_token: Optional[str] = None,
+    processing_token: Optional[str] = None
+):
+    """
+    Error callback of the processing pipeline
+    """
+    run_async(fail_pipeline(document_id, exc, schedule_token, processing_token))
+
+
+def build_processing_pipeline(document_id: str, schedule_token: Optional[str] = None):
+    """
+    Build the Celery chain that processes a document stage by stage
+    """
+    # Identifies this pipeline as the holder of the document's processing lease
+    processing_token = uuid.uuid4().hex
+    return chain(
+        extract_stage_task.s(document_id, processing_token),
+        ocr_stage_task.s(),
+        chunk_stage_task.s(),
+        analyze_stage_task.s(),
+        persist_stage_task.s(schedule_token=schedule_token)
+    ).on_error(pipeline_failed_task.s(document_id, schedule_token, processing_token))
+
+
+@celery_app.task(name='document_comparison')
+def compare_documents_task(doc1_id: str, doc2_id: str):
+    """
+    Celery task for document comparison
+    """
+    return run_async(compare_documents(doc1_id, doc2_id))
+
+
+async def get_document(db: Session, document_id: str) -> Optional[Document]:
+    """
+    Load a document in a worker thread, so the query does not block the shared event loop
+    """
+    return await asyncio.to_thread(db.query(Document).filter(Document.id == document_id).first)
+
+
+async def start_pipeline(document_id: str, processing_token: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Start processing a document unless it is already processed or being
+    processed. Only the pipeline holding the processing:<document_id> lease
+    does the work; the stages of any other pipeline for the document pass
+    its state through untouched.
+    """
+    cache = get_cache_service()
+    processing_token = processing_token or uuid.uuid4().hex
+    if await cache.get_analysis_cache(document_id, "complete") is not None:
+        logger.info(f"Document {document_id} is already processed, skipping pipeline")
+        return {"document_id": document_id, "coalesced": True}
+    if not await cache.acquire_lease(f"processing:{document_id}", processing_token, PIPELINE_LEASE_TTL):
+        # Only skip the document when another pipeline demonstrably has it. A
+        # retry may find this pipeline's own lease, taken by an attempt whose
+        # reply was lost.
+        holder = await cache.get_lease_holder(f"processing:{document_id}")
+        if holder is None:
+            raise LeaseError(f"Could not determine the processing lease holder of {document_id}")
+        if holder != processing_token:
+            logger.info(f"Document {document_id} is already being processed, skipping pipeline")
+            return {"document_id": document_id, "coalesced": True}
+
+    db = next(get_db())
+    try:
+        document = await get_document(db, document_id)
+        if not document:
+            raise ValueError(f"Document not found: {document_id}")
+
+        processor = DocumentProcessor(db)
+        state = await processor.start_processing(document)
+        state["processing_token"] = processing_token
+        return await processor.extract_text_layer(state)
+
+    finally:
+        await asyncio.to_thread(db.close)
+
+
+async def run_pipeline_stage(stage: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    if state.get("coalesced"):
+        return state
+    await renew_processing_lease(state)
+
+    db = next(get_db())
+    try:
+        return await getattr(DocumentProcessor(db, TASK_OCR_WORKERS), stage)(state)
+    finally:
+        await asyncio.to_thread(db.close)
+
+
+async def renew_processing_lease(state: Dict[str, Any]):
+    """
+    Keep holding the document's processing lease between pipeline stages
+    """
+    document_id = state["document_id"]
+    if state.get("processing_token") and not await get_cache_service().renew_lease(
+        f"processing:{document_id}", state["processing_token"], PIPELINE_LEASE_TTL
+    ):
+        logger.warning(f"Lost processing lease for {document_id}, continuing pipeline")
+
+
+async def finish_pipeline(state: Dict[str, Any], schedule_token: Optional[str] = None) -> Dict[str, Any]:
+    cache = get_cache_service()
+    document_id = state["document_id"]
+    if state.get("coalesced"):
+        if schedule_token:
+            await cache.release_lease(f"schedule:{document_id}", schedule_token)
+        return await cache.get_analysis_cache(document_id, "complete") or {
+            "status": "coalesced",
+            "document_id": document_id
+        }
+
+    db = next(get_db())
+    try:
+        document = await get_document(db, document_id)
+        if not document:
+            raise ValueError(f"Document not found: {document_id}")
+
+        result = await DocumentProcessor(db).finish_processing(document, state)
+        await cache.set_analysis_cache(document_id, "complete", result)
+        return result
+
+    finally:
+        if state.get("processing_token"):
+            await cache.release_lease(f"processing:{document_id}", state["processing_token"])
+        if schedule_token:
+            await cache.release_lease(f"schedule:{document_id}", schedule_token)
+        await asyncio.to_thread(db.close)
+
+
+async def fail_pipeline(
+    document_id: str,
+    error: BaseException,
+    schedule_token: Optional[str] = None,
+    processing_token: Optional[str] = None
+):
+    logger.error(f"Error in processing pipeline for {document_id}: {str(error)}")
+    cache = get_cache_service()
+    db = next(get_db())
+    try:
+        # Leave the document alone while another pipeline is processing it
+        holder = await cache.get_lease_holder(f"processing:{document_id}")
+        if holder is None or holder == processing_token:
+            document = await get_document(db, document_id)
             if document:
-                document.update_status(DocumentStatus.ERROR)
-                document.metadata['error'] = str(e)
-                db.commit()
-            raise
+                await DocumentProcessor(db).fail_processing(document, error)
+    finally:
+        if processing_token:
+            await cache.release_lease(f"processing:{document_id}", processing_token)
+        if schedule_token:
+            await cache.release_lease(f"schedule:{document_id}", schedule_token)
+        await asyncio.to_thread(db.close)
 
-    @celery_app.task(name='document_comparison')
-    def compare_documents_task(self, doc1_id: str, doc2_id: str):
-        """
-        Celery task for document comparison
-        """
-        try:
-            db = next(get_db())
-            doc1 = db.query(Document).filter(Document.id == doc1_id).first()
-            doc2 = db.query(Document).filter(Document.id == doc2_id).first()
 
-            if not doc1 or not doc2:
-                raise ValueError("One or both documents not found")
+async def compare_documents(doc1_id: str, doc2_id: str) -> Dict[str, Any]:
+    """
+    Compare two documents once, even if several workers received the pair,
+    and cache the comparison
+    """
+    cache = get_cache_service()
+    db = next(get_db())
+    try:
+        doc1 = await get_document(db, doc1_id)
+        doc2 = await get_document(db, doc2_id)
 
-            processor = DocumentProcessor(db)
-            loop = asyncio.get_event_loop()
-            
-            # Compare documents
-            result = loop.run_until_complete(
-                processor.compare_document_versions(doc1, doc2)
-            )
+        if not doc1 or not doc2:
+            raise ValueError("One or both documents not found")
 
-            # Cache comparison results
-            loop.run_until_complete(
-                self.cache.set_comparison_cache(doc1_id, doc2_id, result)
-            )
+        processor = DocumentProcessor(db, TASK_OCR_WORKERS)
 
+        async def compute():
+            result = await processor.compare_document_versions(doc1, doc2)
+            await cache.set_comparison_cache(doc1_id, doc2_id, result)
             return result
 
-        except Exception as e:
-            logger.error(f"Error in document comparison: {str(e)}")
-            raise
+        # Only one worker compares a pair; duplicates wait for its cached result
+        return await get_single_flight().run(
+            f"comparison:{doc1_id}:{doc2_id}",
+            compute,
+            lambda: cache.get_comparison_cache(doc1_id, doc2_id)
+        )
+
+    except Exception as e:
+        logger.error(f"Error in document comparison: {str(e)}")
+        raise
+
+    finally:
+        await asyncio.to_thread(db.close)
+
+
+class BackgroundTaskService:
+    def __init__(self):
+        self.cache = get_cache_service()
+        # Upper bound on how long a scheduled processing task blocks rescheduling
+        self.schedule_lease_ttl = timedelta(seconds=int(os.getenv("PROCESSING_SCHEDULE_LEASE_SECONDS", "3600")))
 
     async def schedule_document_processing(self, document: Document) -> str:
         """
@@ -112,9 +377,22 @@ class BackgroundTaskService:
             if cached_result:
                 return cached_result
 
-            # Schedule processing
-            task = self.process_document_task.delay(str(document.id))
-            
+            # Reuse the task already scheduled for this document, if any
+            document_id = str(document.id)
+            task_id = uuid.uuid4().hex
+            try:
+                if not await self.cache.acquire_lease(f"schedule:{document_id}", task_id, self.schedule_lease_ttl):
+                    existing_task_id = await self.cache.get_lease_holder(f"schedule:{document_id}")
+                    if existing_task_id:
+                        return existing_task_id
+                    await self.cache.acquire_lease(f"schedule:{document_id}", task_id, self.schedule_lease_ttl)
+            except LeaseError:
+                # The processing lease still keeps duplicate pipelines from doing the work twice
+                logger.warning(f"Scheduling {document_id} without a schedule lease")
+
+            # Schedule the processing pipeline; its final stage carries task_id
+            task = build_processing_pipeline(document_id, task_id).apply_async(task_id=task_id)
+
             # Store task ID in document metadata
             document.metadata['task_id'] = task.id
             return task.id
@@ -123,6 +401,51 @@ class BackgroundTaskService:
             logger.error(f"Error scheduling document processing: {str(e)}")
             raise
 
+    async def schedule_batch_processing(self, document_ids: List[str], batch_id: Optional[str] = None) -> str:
+        """
+        Schedule processing of many new documents as one Celery group.
+        Returns the batch id, which is also the id of the saved group result.
+        """
+        try:
+            batch_id = batch_id or uuid.uuid4().hex
+            result = group(
+                build_processing_pipeline(document_id) for document_id in document_ids
+            ).apply_async(task_id=batch_id)
+            # Persist the group so its progress can be restored from the id alone
+            result.save()
+            return result.id
+
+        except Exception as e:
+            logger.error(f"Error scheduling batch processing: {str(e)}")
+            raise
+
+    async def get_batch_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get aggregate progress of a batch scheduled with schedule_batch_processing
+        """
+        try:
+            result = GroupResult.restore(batch_id, app=celery_app)
+            if result is None:
+                return None
+
+            states = [child.state for child in result.results]
+            return {
+                'batch_id': batch_id,
+                'total': len(states),
+                'completed': sum(1 for state in states if state == 'SUCCESS'),
+                'failed': sum(1 for state in states if state in ('FAILURE', 'REVOKED')),
+                'pending': sum(1 for state in states if state not in ('SUCCESS', 'FAILURE', 'REVOKED')),
+                'ready': result.ready()
+            }
+
+        except Exception as e:
+            logger.error(f"Error getting batch status: {str(e)}")
+            return {
+                'batch_id': batch_id,
+                'status': 'ERROR',
+                'error': str(e)
+            }
+
     async def schedule_document_comparison(self, doc1_id: str, doc2_id: str) -> str:
         """
         Schedule document comparison in background
@@ -134,7 +457,7 @@ class BackgroundTaskService:
                 return cached_result
 
             # Schedule comparison
-            task = self.compare_documents_task.delay(doc1_id, doc2_id)
+            task = compare_documents_task.delay(doc1_id, doc2_id)
             return task.id
 
         except Exception as e:
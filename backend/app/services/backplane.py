@@ -0,0 +1,118 @@
+import os
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, List, Optional
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """
+    Relays WebSocket events between the connection managers of every worker
+    and node. Messages are opaque strings; every subscriber receives every
+    message, including its own.
+    """
+
+    @abstractmethod
+    async def publish(self, message: str):
+        """
+        Send a message to every subscriber
+        """
+
+    @abstractmethod
+    async def start(self, handler: MessageHandler):
+        """
+        Start delivering messages to handler
+        """
+
+    async def close(self):
+        pass
+
+
+class InMemoryBackplane(Backplane):
+    """
+    Process-local backplane for a single worker and for tests. Managers
+    sharing one instance see each other's messages.
+    """
+
+    def __init__(self):
+        self._handlers: List[MessageHandler] = []
+
+    async def publish(self, message: str):
+        for handler in list(self._handlers):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error(f"Backplane handler failed: {str(e)}")
+
+    async def start(self, handler: MessageHandler):
+        self._handlers.append(handler)
+
+    async def close(self):
+        self._handlers.clear()
+
+
+class RedisBackplane(Backplane):
+    """
+    Backplane over a Redis pub/sub channel
+    """
+
+    def __init__(self, redis_url: str, channel: str):
+        self.redis = redis.from_url(redis_url, decode_responses=True)
+        self.channel = channel
+        self._listener: Optional[asyncio.Task] = None
+
+    async def publish(self, message: str):
+        try:
+            await self.redis.publish(self.channel, message)
+        except Exception as e:
+            logger.error(f"Error publishing to backplane: {str(e)}")
+
+    async def start(self, handler: MessageHandler):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen(handler))
+
+    async def _listen(self, handler: MessageHandler):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        try:
+                            await handler(message["data"])
+                        except Exception as e:
+                            logger.error(f"Backplane handler failed: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane subscriber failed, reconnecting: {str(e)}")
+            finally:
+                await pubsub.close()
+            await asyncio.sleep(1)
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+        await self.redis.close()
+
+
+def get_backplane() -> Backplane:
+    """
+    Build the backplane selected by WS_BACKPLANE ("redis" or "memory")
+    """
+    kind = os.getenv("WS_BACKPLANE", "redis").lower()
+    if kind == "memory":
+        return InMemoryBackplane()
+    if kind != "redis":
+        raise ValueError(f"Unknown WS_BACKPLANE: {kind}")
+    return RedisBackplane(
+        os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        os.getenv("WS_BACKPLANE_CHANNEL", "ws:events")
+    )
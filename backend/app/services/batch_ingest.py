@@ -0,0 +1,211 @@
+import os
+import uuid
+import zipfile
+import asyncio
+import logging
+import mimetypes
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+import aiofiles
+from fastapi import UploadFile
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from .background_tasks import BackgroundTaskService
+from .cache_service import get_cache_service
+from ..models.document import Document, DocumentType
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BatchIngestError(ValueError):
+    pass
+
+
+class BatchIngestService:
+    """
+    Bulk document ingest: streams many uploads (or zip archives of documents)
+    to disk, creates their Document rows in one transaction and schedules
+    their processing as a single Celery group
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.cache = get_cache_service()
+        self.background_tasks = BackgroundTaskService()
+        self.upload_dir = Path(os.getenv('UPLOAD_DIR', './uploads'))
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self.allowed_extensions = {'.pdf', '.docx', '.txt'}
+        self.max_file_size = int(os.getenv('MAX_UPLOAD_SIZE', str(10 * 1024 * 1024)))
+        self.max_files = int(os.getenv('BATCH_MAX_FILES', '5000'))
+        self.max_archive_size = int(os.getenv('BATCH_MAX_ARCHIVE_SIZE', str(2 * 1024 * 1024 * 1024)))
+
+    async def ingest(self, files: List[UploadFile], document_type: DocumentType, user) -> Dict[str, Any]:
+        """
+        Store every uploaded document, create the documents and schedule their processing
+        """
+        staged: List[Tuple[str, Path, int]] = []
+        try:
+            for upload in files:
+                if Path(upload.filename or '').suffix.lower() == '.zip':
+                    staged.extend(await self._stage_archive(upload, self.max_files - len(staged)))
+                else:
+                    staged.append(await self._stage_upload(upload))
+                if len(staged) > self.max_files:
+                    raise BatchIngestError(f"A batch may contain at most {self.max_files} documents")
+
+            if not staged:
+                raise BatchIngestError("No supported documents in upload")
+
+            batch_id = uuid.uuid4().hex
+            documents = [
+                Document(
+                    title=Path(filename).stem,
+                    document_type=document_type,
+                    file_path=str(path),
+                    file_size=str(size),
+                    file_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                    user_id=user.id,
+                    metadata={'batch_id': batch_id, 'original_filename': filename}
+                )
+                for filename, path, size in staged
+            ]
+            self.db.add_all(documents)
+            self.db.commit()
+
+        except Exception:
+            self.db.rollback()
+            for _, path, _ in staged:
+                path.unlink(missing_ok=True)
+            raise
+
+        document_ids = [str(document.id) for document in documents]
+        try:
+            await self.cache.set_batch(batch_id, {'user_id': str(user.id), 'document_ids': document_ids})
+            await self.background_tasks.schedule_batch_processing(document_ids, batch_id)
+        except Exception:
+            # Don't leave documents behind that nothing will ever process
+            logger.error(f"Batch {batch_id}: scheduling failed, removing its {len(documents)} documents")
+            self._discard(documents, staged)
+            raise
+
+        logger.info(f"Batch {batch_id}: scheduled processing of {len(document_ids)} documents")
+        return {'batch_id': batch_id, 'document_ids': document_ids}
+
+    async def get_status(self, batch_id: str, user) -> Optional[Dict[str, Any]]:
+        """
+        Get the progress of a batch owned by the user, or None if there is no such batch
+        """
+        batch = await self.cache.get_batch(batch_id)
+        if not batch or batch['user_id'] != str(user.id):
+            return None
+        status = await self.background_tasks.get_batch_status(batch_id) or {'batch_id': batch_id}
+        return {**status, 'document_ids': batch['document_ids']}
+
+    def _discard(self, documents: List[Document], staged: List[Tuple[str, Path, int]]):
+        """
+        Delete the documents of a batch that could not be scheduled, and their files
+        """
+        try:
+            for document in documents:
+                self.db.delete(document)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error removing unscheduled documents: {str(e)}")
+            # The rows remain, so keep the files they point to
+            return
+        for _, path, _ in staged:
+            path.unlink(missing_ok=True)
+
+    def _check_extension(self, filename: str) -> bool:
+        return Path(filename).suffix.lower() in self.allowed_extensions
+
+    def _new_upload_path(self, filename: str) -> Path:
+        # Never derive paths from client-supplied names
+        return self.upload_dir / f"{uuid.uuid4()}{Path(filename).suffix.lower()}"
+
+    async def _stage_upload(self, upload: UploadFile) -> Tuple[str, Path, int]:
+        """
+        Stream one uploaded document to disk
+        """
+        filename = upload.filename or 'document'
+        if not self._check_extension(filename):
+            raise BatchIngestError(f"Unsupported file type: {filename}")
+
+        path = self._new_upload_path(filename)
+        size = 0
+        try:
+            async with aiofiles.open(path, 'wb') as file:
+                while chunk := await upload.read(COPY_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        raise BatchIngestError(f"{filename} exceeds the maximum upload size")
+                    await file.write(chunk)
+        except Exception:
+            path.unlink(missing_ok=True)
+            raise
+        return filename, path, size
+
+    async def _stage_archive(self, upload: UploadFile, max_members: int) -> List[Tuple[str, Path, int]]:
+        """
+        Stream a zip archive to a temporary file and unpack its supported documents
+        """
+        fd, archive_path = tempfile.mkstemp(dir=self.upload_dir, suffix='.zip')
+        os.close(fd)
+        try:
+            size = 0
+            async with aiofiles.open(archive_path, 'wb') as file:
+                while chunk := await upload.read(COPY_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_archive_size:
+                        raise BatchIngestError(f"{upload.filename} exceeds the maximum archive size")
+                    await file.write(chunk)
+
+            return await asyncio.to_thread(self._unpack_archive, archive_path, max_members)
+        except zipfile.BadZipFile:
+            raise BatchIngestError(f"{upload.filename} is not a valid zip archive")
+        finally:
+            os.remove(archive_path)
+
+    def _unpack_archive(self, archive_path: str, max_members: int) -> List[Tuple[str, Path, int]]:
+        staged = []
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                for member in archive.infolist():
+                    name = Path(member.filename).name
+                    if member.is_dir() or member.filename.startswith('__MACOSX/') or name.startswith('.'):
+                        continue
+                    if not self._check_extension(name):
+                        continue
+                    if len(staged) >= max_members:
+                        raise BatchIngestError(f"A batch may contain at most {self.max_files} documents")
+                    if member.file_size > self.max_file_size:
+                        raise BatchIngestError(f"{name} exceeds the maximum upload size")
+
+                    path = self._new_upload_path(name)
+                    try:
+                        with archive.open(member) as source, open(path, 'wb') as target:
+                            # Declared sizes can lie, so enforce the limit while copying
+                            size = self._copy_limited(source, target, name)
+                    except Exception:
+                        path.unlink(missing_ok=True)
+                        raise
+                    staged.append((name, path, size))
+        except Exception:
+            for _, path, _ in staged:
+                path.unlink(missing_ok=True)
+            raise
+        return staged
+
+    def _copy_limited(self, source: BinaryIO, target: BinaryIO, name: str) -> int:
+        size = 0
+        while chunk := source.read(COPY_CHUNK_SIZE):
+            size += len(chunk)
+            if size > self.max_file_size:
+                raise BatchIngestError(f"{name} exceeds the maximum upload size")
+            target.write(chunk)
+        return size
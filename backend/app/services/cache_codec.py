@@ -0,0 +1,170 @@
+import os
+import json
+import zlib
+import logging
+from typing import Any, Union
+from dotenv import load_dotenv
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover - optional dependency
+    lz4_frame = None
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Encoded payloads start with MAGIC, a format version byte and a flags byte:
+# the low nibble identifies the serializer, the high nibble the compressor.
+MAGIC = b"LM"
+FORMAT_VERSION = 1
+HEADER_SIZE = 4
+
+SERIALIZERS = {"json": 0, "orjson": 1, "msgpack": 2}
+COMPRESSORS = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+
+
+class CacheCodecError(ValueError):
+    pass
+
+
+class CacheCodec:
+    """
+    Serializes cache values to compact bytes, compressing payloads above a
+    size threshold. Payloads without a header are decoded as legacy JSON.
+    """
+
+    def __init__(
+        self,
+        serializer: str = "auto",
+        compressor: str = "auto",
+        compress_threshold: int = 1024,
+        compression_level: int = 3
+    ):
+        self.serializer = self._resolve_serializer(serializer)
+        self.compressor = self._resolve_compressor(compressor)
+        self.compress_threshold = compress_threshold
+        self.compression_level = compression_level
+        self._zstd_compressor = zstandard.ZstdCompressor(level=compression_level) if zstandard else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    @staticmethod
+    def _resolve_serializer(name: str) -> str:
+        if name == "auto":
+            return "msgpack" if msgpack else "orjson" if orjson else "json"
+        if name == "msgpack" and msgpack is None or name == "orjson" and orjson is None:
+            raise CacheCodecError(f"Serializer {name} is not installed")
+        if name not in SERIALIZERS:
+            raise CacheCodecError(f"Unknown serializer: {name}")
+        return name
+
+    @staticmethod
+    def _resolve_compressor(name: str) -> str:
+        if name == "auto":
+            return "zstd" if zstandard else "lz4" if lz4_frame else "zlib"
+        if name == "zstd" and zstandard is None or name == "lz4" and lz4_frame is None:
+            raise CacheCodecError(f"Compressor {name} is not installed")
+        if name not in COMPRESSORS:
+            raise CacheCodecError(f"Unknown compressor: {name}")
+        return name
+
+    def encode(self, value: Any) -> bytes:
+        """
+        Encode a value into a versioned, possibly compressed payload
+        """
+        body = self._serialize(value)
+        compressor = "none"
+        if self.compressor != "none" and len(body) >= self.compress_threshold:
+            compressed = self._compress(body)
+            if len(compressed) < len(body):
+                body, compressor = compressed, self.compressor
+        flags = SERIALIZERS[self.serializer] | (COMPRESSORS[compressor] << 4)
+        return MAGIC + bytes((FORMAT_VERSION, flags)) + body
+
+    def decode(self, payload: Union[bytes, str]) -> Any:
+        """
+        Decode a payload produced by encode, or a legacy plain JSON value
+        """
+        if isinstance(payload, str):
+            return json.loads(payload)
+        if not payload.startswith(MAGIC) or len(payload) < HEADER_SIZE:
+            return json.loads(payload)
+
+        version, flags = payload[2], payload[3]
+        if version != FORMAT_VERSION:
+            raise CacheCodecError(f"Unsupported cache payload version: {version}")
+        serializer = _name_for(SERIALIZERS, flags & 0x0F)
+        compressor = _name_for(COMPRESSORS, flags >> 4)
+
+        body = payload[HEADER_SIZE:]
+        if compressor != "none":
+            body = self._decompress(body, compressor)
+        return self._deserialize(body, serializer)
+
+    def _serialize(self, value: Any) -> bytes:
+        if self.serializer == "msgpack":
+            return msgpack.packb(value, use_bin_type=True)
+        if self.serializer == "orjson":
+            return orjson.dumps(value)
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def _deserialize(body: bytes, serializer: str) -> Any:
+        if serializer == "msgpack":
+            if msgpack is None:
+                raise CacheCodecError("Payload needs msgpack, which is not installed")
+            return msgpack.unpackb(body, raw=False)
+        if serializer == "orjson" and orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+
+    def _compress(self, body: bytes) -> bytes:
+        if self.compressor == "zstd":
+            return self._zstd_compressor.compress(body)
+        if self.compressor == "lz4":
+            return lz4_frame.compress(body, compression_level=self.compression_level)
+        return zlib.compress(body, self.compression_level)
+
+    def _decompress(self, body: bytes, compressor: str) -> bytes:
+        if compressor == "zstd":
+            if self._zstd_decompressor is None:
+                raise CacheCodecError("Payload needs zstandard, which is not installed")
+            return self._zstd_decompressor.decompress(body)
+        if compressor == "lz4":
+            if lz4_frame is None:
+                raise CacheCodecError("Payload needs lz4, which is not installed")
+            return lz4_frame.decompress(body)
+        return zlib.decompress(body)
+
+
+def _name_for(ids: dict, value: int) -> str:
+    for name, id_ in ids.items():
+        if id_ == value:
+            return name
+    raise CacheCodecError(f"Unknown codec id in cache payload: {value}")
+
+
+def codec_from_env() -> CacheCodec:
+    """
+    Build the cache codec configured by the environment
+    """
+    return CacheCodec(
+        serializer=os.getenv("CACHE_SERIALIZER", "auto"),
+        compressor=os.getenv("CACHE_COMPRESSOR", "auto"),
+        compress_threshold=int(os.getenv("CACHE_COMPRESS_THRESHOLD", "1024")),
+        compression_level=int(os.getenv("CACHE_COMPRESSION_LEVEL", "3"))
+    )
@@ -1,25 +1,224 @@
 import redis.asyncio as redis
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, List, Tuple
 import os
 from dotenv import load_dotenv
 import logging
 import pickle
+import time
+import uuid
+import asyncio
 from datetime import timedelta
+from .local_cache import get_local_cache
+from .cache_codec import codec_from_env
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Keys that may be served from the in-process tier; writes to them are broadcast for invalidation
+LOCAL_TIER_PREFIXES = ("analysis:", "comparison:", "processing_status:")
+INVALIDATION_CHANNEL = "cache:invalidate"
+PROGRESS_CHANNEL_PREFIX = "progress:"
+
+# Identifies this process in invalidation messages so it ignores its own
+_NODE_ID = uuid.uuid4().hex
+_subscriber_task: Optional[asyncio.Task] = None
+_subscriber_ready = False
+_redis_tier_stats = {"hits": 0, "misses": 0}
+
+# Compare-and-delete / compare-and-expire so only the lease holder can release or renew it
+RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+RENEW_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class LeaseError(Exception):
+    """
+    The state of a lease could not be determined, e.g. because Redis is unreachable
+    """
+
+
 class CacheService:
     def __init__(self):
         self.redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
         self.redis = redis.from_url(self.redis_url, decode_responses=True)
-        
+        # Binary-safe client for encoded payloads and raw document bytes
+        self.binary_redis = redis.from_url(self.redis_url, decode_responses=False)
+        self.codec = codec_from_env()
+        self.local = get_local_cache()
+
         # Cache timeouts
         self.TIMEOUTS = {
             "analysis": timedelta(hours=24),
             "document": timedelta(hours=12),
-            "comparison": timedelta(hours=6)
+            "comparison": timedelta(hours=6),
+            "file_hash": timedelta(days=7),
+            "batch": timedelta(days=7),
+            "llm_response": timedelta(seconds=int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))),
+            # Outlives every document-scoped entry it indexes
+            "key_index": timedelta(days=8)
+        }
+
+        # Fall back to SCAN for documents cached before key indexes existed
+        self.legacy_scan_invalidation = os.getenv("CACHE_LEGACY_SCAN_INVALIDATION", "true").lower() in ("1", "true", "yes")
+
+        # LLM response cache bounds
+        self.llm_cache_max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+        self.llm_cache_max_entry_bytes = int(os.getenv("LLM_CACHE_MAX_ENTRY_BYTES", str(256 * 1024)))
+
+    def _track_keys(self, pipe, document_ids: Iterable[str], *keys: str):
+        """
+        Record keys in the per-document key index so they can be invalidated without a keyspace scan
+        """
+        for document_id in document_ids:
+            index_key = f"doc_keys:{document_id}"
+            pipe.sadd(index_key, *keys)
+            pipe.expire(index_key, self.TIMEOUTS["key_index"])
+
+    async def _get_value(self, key: str) -> Optional[Any]:
+        """
+        Read an encoded entry from the local tier, falling back to Redis
+        """
+        use_local = key.startswith(LOCAL_TIER_PREFIXES) and await self._local_tier_ready()
+        if use_local:
+            payload = self.local.get(key)
+            if payload is not None:
+                return self.codec.decode(payload)
+
+        payload = await self.binary_redis.get(key)
+        _redis_tier_stats["hits" if payload else "misses"] += 1
+        if payload is None:
+            return None
+        value = self.codec.decode(payload)
+        if use_local:
+            self.local.set(key, payload)
+        return value
+
+    async def _get_many_values(self, keys: List[str]) -> List[Optional[Any]]:
+        """
+        Read many encoded entries, serving local tier hits and fetching the rest with one MGET
+        """
+        values: List[Optional[Any]] = [None] * len(keys)
+        use_local = await self._local_tier_ready()
+        missing = []
+        for index, key in enumerate(keys):
+            payload = self.local.get(key) if use_local and key.startswith(LOCAL_TIER_PREFIXES) else None
+            if payload is not None:
+                values[index] = self.codec.decode(payload)
+            else:
+                missing.append(index)
+        if not missing:
+            return values
+
+        payloads = await self.binary_redis.mget([keys[index] for index in missing])
+        for index, payload in zip(missing, payloads):
+            _redis_tier_stats["hits" if payload else "misses"] += 1
+            if payload is None:
+                continue
+            try:
+                values[index] = self.codec.decode(payload)
+            except Exception as e:
+                logger.error(f"Error decoding cached {keys[index]}: {str(e)}")
+                continue
+            if use_local:
+                self._store_local(keys[index], payload)
+        return values
+
+    async def _set_many_values(self, entries: List[Tuple[str, List[str], Any]], ttl: Optional[timedelta]):
+        """
+        Write many (key, document_ids, value) entries in one pipeline
+        """
+        payloads = []
+        async with self.binary_redis.pipeline(transaction=False) as pipe:
+            for key, document_ids, value in entries:
+                payload = self.codec.encode(value)
+                payloads.append((key, payload))
+                if ttl:
+                    pipe.setex(key, ttl, payload)
+                else:
+                    pipe.set(key, payload)
+                self._track_keys(pipe, document_ids, key)
+                self._after_write(pipe, key)
+            await pipe.execute()
+        for key, payload in payloads:
+            self._store_local(key, payload)
+
+    def _after_write(self, pipe, key: str):
+        """
+        Queue the cross-process invalidation of a local-tier key on a write pipeline
+        """
+        if key.startswith(LOCAL_TIER_PREFIXES):
+            pipe.publish(INVALIDATION_CHANNEL, json.dumps({"origin": _NODE_ID, "keys": [key]}))
+
+    def _store_local(self, key: str, payload: bytes):
+        if self.local is not None and _subscriber_ready and key.startswith(LOCAL_TIER_PREFIXES):
+            self.local.set(key, payload)
+
+    async def _local_tier_ready(self) -> bool:
+        """
+        Check that the local tier is enabled and kept coherent by the invalidation subscriber
+        """
+        global _subscriber_task
+        if self.local is None:
+            return False
+        if _subscriber_task is None or _subscriber_task.done():
+            _subscriber_task = asyncio.create_task(self._listen_for_invalidations())
+        return _subscriber_ready
+
+    async def _listen_for_invalidations(self):
+        """
+        Evict local entries written or invalidated by other processes
+        """
+        global _subscriber_ready
+        client = redis.from_url(self.redis_url, decode_responses=True)
+        while True:
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                _subscriber_ready = True
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._apply_invalidation(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation subscriber failed, reconnecting: {str(e)}")
+            finally:
+                # Messages may have been missed, so nothing local can be trusted
+                _subscriber_ready = False
+                self.local.clear()
+                await pubsub.close()
+            await asyncio.sleep(1)
+
+    def _apply_invalidation(self, message: Dict[str, Any]):
+        if message.get("origin") == _NODE_ID:
+            return
+        for key in message.get("keys", []):
+            self.local.delete(key)
+        for document_id in message.get("documents", []):
+            self.local.delete_matching(lambda key: f":{document_id}" in key)
+
+    async def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        Get hit-rate metrics for each cache tier
+        """
+        redis_lookups = _redis_tier_stats["hits"] + _redis_tier_stats["misses"]
+        return {
+            "local": self.local.stats() if self.local is not None else None,
+            "redis": {
+                **_redis_tier_stats,
+                "hit_rate": _redis_tier_stats["hits"] / redis_lookups if redis_lookups else 0.0
+            },
+            "llm_responses": await self.get_llm_cache_stats()
         }
 
     async def get_analysis_cache(self, document_id: str, analysis_type: str) -> Optional[Dict[str, Any]]:
@@ -28,10 +227,7 @@ class CacheService:
         """
         try:
             key = f"analysis:{document_id}:{analysis_type}"
-            cached = await self.redis.get(key)
-            if cached:
-                return json.loads(cached)
-            return None
+            return await self._get_value(key)
         except Exception as e:
             logger.error(f"Error getting from cache: {str(e)}")
             return None
@@ -42,21 +238,53 @@ class CacheService:
         """
         try:
             key = f"analysis:{document_id}:{analysis_type}"
-            await self.redis.setex(
-                key,
-                self.TIMEOUTS["analysis"],
-                json.dumps(result)
-            )
+            payload = self.codec.encode(result)
+            async with self.binary_redis.pipeline(transaction=True) as pipe:
+                pipe.setex(key, self.TIMEOUTS["analysis"], payload)
+                self._track_keys(pipe, [document_id], key)
+                self._after_write(pipe, key)
+                await pipe.execute()
+            self._store_local(key, payload)
         except Exception as e:
             logger.error(f"Error setting cache: {str(e)}")
 
+    async def get_many_analysis_cache(
+        self,
+        document_ids: List[str],
+        analysis_type: str
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get cached analysis results for many documents in one round trip
+        """
+        try:
+            keys = [f"analysis:{document_id}:{analysis_type}" for document_id in document_ids]
+            return dict(zip(document_ids, await self._get_many_values(keys)))
+        except Exception as e:
+            logger.error(f"Error getting many from cache: {str(e)}")
+            return {document_id: None for document_id in document_ids}
+
+    async def set_many_analysis_cache(self, analysis_type: str, results: Dict[str, Dict[str, Any]]):
+        """
+        Cache analysis results for many documents in one pipeline
+        """
+        try:
+            await self._set_many_values(
+                [
+                    (f"analysis:{document_id}:{analysis_type}", [document_id], result)
+                    for document_id, result in results.items()
+                ],
+                self.TIMEOUTS["analysis"]
+            )
+        except Exception as e:
+            logger.error(f"Error setting many in cache: {str(e)}")
+
     async def get_document_cache(self, document_id: str) -> Optional[bytes]:
         """
         Get cached document content
         """
         try:
             key = f"document:{document_id}"
-            return await self.redis.get(key)
+            return await self.binary_redis.get(key)
         except Exception as e:
             logger.error(f"Error getting document from cache: {str(e)}")
             return None
@@ -67,11 +295,10 @@ class CacheService:
         """
         try:
             key = f"document:{document_id}"
-            await self.redis.setex(
-                key,
-                self.TIMEOUTS["document"],
-                content
-            )
+            async with self.binary_redis.pipeline(transaction=True) as pipe:
+                pipe.setex(key, self.TIMEOUTS["document"], content)
+                self._track_keys(pipe, [document_id], key)
+                await pipe.execute()
         except Exception as e:
             logger.error(f"Error caching document: {str(e)}")
 
@@ -81,10 +308,7 @@ class CacheService:
         """
         try:
             key = f"comparison:{doc1_id}:{doc2_id}"
-            cached = await self.redis.get(key)
-            if cached:
-                return json.loads(cached)
-            return None
+            return await self._get_value(key)
         except Exception as e:
             logger.error(f"Error getting comparison from cache: {str(e)}")
             return None
@@ -95,51 +319,273 @@ class CacheService:
         """
         try:
             key = f"comparison:{doc1_id}:{doc2_id}"
-            await self.redis.setex(
-                key,
-                self.TIMEOUTS["comparison"],
-                json.dumps(result)
-            )
+            payload = self.codec.encode(result)
+            async with self.binary_redis.pipeline(transaction=True) as pipe:
+                pipe.setex(key, self.TIMEOUTS["comparison"], payload)
+                self._track_keys(pipe, [doc1_id, doc2_id], key)
+                self._after_write(pipe, key)
+                await pipe.execute()
+            self._store_local(key, payload)
         except Exception as e:
             logger.error(f"Error caching comparison: {str(e)}")
 
+    async def get_document_id_by_hash(self, file_hash: str) -> Optional[str]:
+        """
+        Get the id of an already processed document with the same content hash
+        """
+        try:
+            key = f"file_hash:{file_hash}"
+            return await self.redis.get(key)
+        except Exception as e:
+            logger.error(f"Error getting file hash index: {str(e)}")
+            return None
+
+    async def set_document_id_by_hash(self, file_hash: str, document_id: str):
+        """
+        Index a processed document by its content hash
+        """
+        try:
+            key = f"file_hash:{file_hash}"
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.setex(key, self.TIMEOUTS["file_hash"], document_id)
+                self._track_keys(pipe, [document_id], key)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error setting file hash index: {str(e)}")
+
+    async def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the record of a batch ingest
+        """
+        try:
+            payload = await self.binary_redis.get(f"batch:{batch_id}")
+            return self.codec.decode(payload) if payload else None
+        except Exception as e:
+            logger.error(f"Error getting batch: {str(e)}")
+            return None
+
+    async def set_batch(self, batch_id: str, batch: Dict[str, Any]):
+        """
+        Store the record of a batch ingest (owner and document ids); raises on failure
+        """
+        try:
+            await self.binary_redis.setex(f"batch:{batch_id}", self.TIMEOUTS["batch"], self.codec.encode(batch))
+        except Exception as e:
+            # Unlike cached values, a lost batch record cannot be recomputed
+            logger.error(f"Error setting batch: {str(e)}")
+            raise
+
+    async def get_llm_response(self, prompt_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached LLM response and record the hit or miss
+        """
+        try:
+            key = f"llm_response:{prompt_hash}"
+            cached = await self.binary_redis.get(key)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hincrby("llm_cache:stats", "hits" if cached else "misses", 1)
+                if cached:
+                    # Refresh recency so eviction drops the least recently used entries
+                    pipe.zadd("llm_cache:index", {prompt_hash: time.time()})
+                await pipe.execute()
+            return self.codec.decode(cached) if cached else None
+        except Exception as e:
+            logger.error(f"Error getting LLM response from cache: {str(e)}")
+            return None
+
+    async def set_llm_response(self, prompt_hash: str, response: Dict[str, Any]):
+        """
+        Cache an LLM response, evicting the least recently used entries above the size limit
+        """
+        try:
+            payload = self.codec.encode(response)
+            if len(payload) > self.llm_cache_max_entry_bytes:
+                return
+            key = f"llm_response:{prompt_hash}"
+            async with self.binary_redis.pipeline(transaction=False) as pipe:
+                pipe.setex(key, self.TIMEOUTS["llm_response"], payload)
+                pipe.zadd("llm_cache:index", {prompt_hash: time.time()})
+                pipe.zcard("llm_cache:index")
+                _, _, entries = await pipe.execute()
+
+            overflow = entries - self.llm_cache_max_entries
+            if overflow > 0:
+                evicted = await self.redis.zpopmin("llm_cache:index", overflow)
+                if evicted:
+                    await self.redis.delete(*[f"llm_response:{member}" for member, _ in evicted])
+                    await self.redis.hincrby("llm_cache:stats", "evictions", len(evicted))
+        except Exception as e:
+            logger.error(f"Error caching LLM response: {str(e)}")
+
+    async def get_llm_cache_stats(self) -> Dict[str, Any]:
+        """
+        Get LLM response cache hit/miss metrics
+        """
+        try:
+            stats = await self.redis.hgetall("llm_cache:stats")
+            entries = await self.redis.zcard("llm_cache:index")
+            hits = int(stats.get("hits", 0))
+            misses = int(stats.get("misses", 0))
+            return {
+                "hits": hits,
+                "misses": misses,
+                "evictions": int(stats.get("evictions", 0)),
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "entries": entries
+            }
+        except Exception as e:
+            logger.error(f"Error getting LLM cache stats: {str(e)}")
+            return {}
+
     async def invalidate_document_cache(self, document_id: str):
         """
         Invalidate all caches related to a document
         """
         try:
-            # Get all keys related to this document
-            pattern = f"*:{document_id}*"
-            keys = await self.redis.keys(pattern)
-            if keys:
-                await self.redis.delete(*keys)
+            if self.local is not None:
+                self.local.delete_matching(lambda key: f":{document_id}" in key)
+
+            index_key = f"doc_keys:{document_id}"
+            keys = await self.redis.smembers(index_key)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if keys:
+                    pipe.unlink(*keys, index_key)
+                pipe.publish(INVALIDATION_CHANNEL, json.dumps({"origin": _NODE_ID, "documents": [document_id]}))
+                await pipe.execute()
+            # Pre-index keys may sit alongside indexed ones, so scan whatever the index held
+            if self.legacy_scan_invalidation:
+                await self._scan_invalidate(document_id)
         except Exception as e:
             logger.error(f"Error invalidating cache: {str(e)}")
 
+    async def _scan_invalidate(self, document_id: str, batch_size: int = 500):
+        """
+        Incrementally delete keys written before per-document key indexes existed
+        """
+        batch = []
+        async for key in self.redis.scan_iter(match=f"*:{document_id}*", count=1000):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                await self.redis.unlink(*batch)
+                batch = []
+        if batch:
+            await self.redis.unlink(*batch)
+
     async def get_processing_status(self, document_id: str) -> Optional[Dict[str, Any]]:
         """
         Get document processing status from cache
         """
         try:
             key = f"processing_status:{document_id}"
-            status = await self.redis.get(key)
-            return json.loads(status) if status else None
+            return await self._get_value(key)
         except Exception as e:
             logger.error(f"Error getting processing status: {str(e)}")
             return None
 
-    async def set_processing_status(self, document_id: str, status: Dict[str, Any]):
+    async def set_processing_status(self, document_id: str, status: Dict[str, Any], publish: bool = False):
         """
-        Update document processing status in cache
+        Update document processing status in cache, optionally publishing it
+        to subscribers of progress:<document_id>
         """
         try:
             key = f"processing_status:{document_id}"
-            await self.redis.set(key, json.dumps(status))
+            payload = self.codec.encode(status)
+            async with self.binary_redis.pipeline(transaction=True) as pipe:
+                pipe.set(key, payload)
+                self._track_keys(pipe, [document_id], key)
+                self._after_write(pipe, key)
+                if publish:
+                    pipe.publish(f"{PROGRESS_CHANNEL_PREFIX}{document_id}", json.dumps(status))
+                await pipe.execute()
+            self._store_local(key, payload)
         except Exception as e:
             logger.error(f"Error setting processing status: {str(e)}")
 
+    async def get_many_processing_status(self, document_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get processing status for many documents in one round trip
+        """
+        try:
+            keys = [f"processing_status:{document_id}" for document_id in document_ids]
+            return dict(zip(document_ids, await self._get_many_values(keys)))
+        except Exception as e:
+            logger.error(f"Error getting many processing statuses: {str(e)}")
+            return {document_id: None for document_id in document_ids}
+
+    async def set_many_processing_status(self, statuses: Dict[str, Dict[str, Any]]):
+        """
+        Update processing status for many documents in one pipeline
+        """
+        try:
+            await self._set_many_values(
+                [
+                    (f"processing_status:{document_id}", [document_id], status)
+                    for document_id, status in statuses.items()
+                ],
+                None
+            )
+        except Exception as e:
+            logger.error(f"Error setting many processing statuses: {str(e)}")
+
+    async def acquire_lease(self, name: str, token: str, ttl: timedelta) -> bool:
+        """
+        Take a lease if nobody holds it; the token identifies the holder.
+        Raises LeaseError rather than returning False when Redis fails, so
+        callers never mistake an outage for another holder.
+        """
+        try:
+            return bool(await self.redis.set(f"lease:{name}", token, nx=True, px=ttl))
+        except Exception as e:
+            logger.error(f"Error acquiring lease {name}: {str(e)}")
+            raise LeaseError(f"Could not acquire lease {name}") from e
+
+    async def get_lease_holder(self, name: str) -> Optional[str]:
+        """
+        Get the token of the current lease holder
+        """
+        try:
+            return await self.redis.get(f"lease:{name}")
+        except Exception as e:
+            logger.error(f"Error reading lease {name}: {str(e)}")
+            return None
+
+    async def renew_lease(self, name: str, token: str, ttl: timedelta) -> bool:
+        """
+        Extend a lease still held with the given token
+        """
+        try:
+            ttl_ms = int(ttl.total_seconds() * 1000)
+            return bool(await self.redis.eval(RENEW_LEASE_SCRIPT, 1, f"lease:{name}", token, ttl_ms))
+        except Exception as e:
+            logger.error(f"Error renewing lease {name}: {str(e)}")
+            return False
+
+    async def release_lease(self, name: str, token: str) -> bool:
+        """
+        Release a lease still held with the given token
+        """
+        try:
+            return bool(await self.redis.eval(RELEASE_LEASE_SCRIPT, 1, f"lease:{name}", token))
+        except Exception as e:
+            logger.error(f"Error releasing lease {name}: {str(e)}")
+            return False
+
     async def close(self):
         """
         Close Redis connection
         """
         await self.redis.close()
+        await self.binary_redis.close()
+
+
+_cache_service: Optional[CacheService] = None
+
+
+def get_cache_service() -> CacheService:
+    """
+    Get the CacheService shared by everything in this process
+    """
+    global _cache_service
+    if _cache_service is None:
+        _cache_service = CacheService()
+    return _cache_service
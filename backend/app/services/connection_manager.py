@@ -1,80 +1,419 @@
 from fastapi import WebSocket
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set
+import os
 import json
+import time
+import uuid
+import asyncio
 import logging
+from .backplane import Backplane, get_backplane
 
 logger = logging.getLogger(__name__)
 
+# Close code for clients dropped because they could not keep up ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+class ClientConnection:
+    """
+    One connected client: a bounded queue of serialized outbound frames
+    drained by a dedicated writer task, so a slow client only delays itself
+    """
+
+    def __init__(self, websocket: WebSocket, client_id: str, max_queue_size: int, user_id: Optional[str] = None):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.user_id = user_id
+        self.rooms: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.writer: Optional[asyncio.Task] = None
+
+    def offer(self, text: str) -> bool:
+        """
+        Queue a frame without waiting; False if the client's backlog is full
+        """
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.typing_users: Set[str] = set()
-    
-    async def connect(self, websocket: WebSocket, client_id: str):
+    """
+    Tracks this worker's WebSocket clients and the rooms (e.g.
+    "conversation:<id>", "document:<id>") they have joined. Broadcasts,
+    per-user messages and room presence and typing events are also relayed
+    through a backplane, so they reach clients on other workers and nodes.
+
+    Every node also publishes a snapshot of its rooms as a heartbeat, and a
+    starting node asks the others for theirs, so room state survives missed
+    deltas and late starts. A node that stops sending heartbeats is presumed
+    dead, and its clients leave their rooms.
+    """
+
+    def __init__(self, backplane: Optional[Backplane] = None):
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self._by_websocket: Dict[int, ClientConnection] = {}
+        self._user_clients: Dict[str, Set[str]] = {}
+        self.node_id = uuid.uuid4().hex
+        # Room members and typing clients of each node (node -> room -> client
+        # ids), kept in sync through the backplane
+        self._node_rooms: Dict[str, Dict[str, Set[str]]] = {self.node_id: {}}
+        self._node_typing: Dict[str, Dict[str, Set[str]]] = {self.node_id: {}}
+        # This node's clients in each room
+        self._local_rooms = self._node_rooms[self.node_id]
+        # When each other node was last heard from
+        self._node_seen: Dict[str, float] = {}
+        self.heartbeat_interval = float(os.getenv("WS_NODE_HEARTBEAT_SECONDS", "10"))
+        self.node_timeout = float(os.getenv("WS_NODE_TIMEOUT_SECONDS", str(self.heartbeat_interval * 3)))
+        self._heartbeat: Optional[asyncio.Task] = None
+        # Typing updates within this window are coalesced into one frame per room
+        self.typing_debounce = float(os.getenv("WS_TYPING_DEBOUNCE_MS", "250")) / 1000
+        self._typing_flush_pending: Set[str] = set()
+        self.backplane = backplane or get_backplane()
+        self._backplane_started = False
+        self._tasks: Set[asyncio.Task] = set()
+        # Outbound frames a client may have pending before it is disconnected
+        self.max_queue_size = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+        # How long a personal message may wait for room in a full backlog
+        self.send_timeout = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+    async def connect(self, websocket: WebSocket, client_id: str, user_id: Optional[str] = None):
+        if not self._backplane_started:
+            await self.backplane.start(self._on_backplane_message)
+            self._backplane_started = True
+            # Learn the other nodes' rooms now rather than at their next heartbeat
+            await self._publish({"kind": "sync_request"})
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+
+        previous = self.active_connections.get(client_id)
+        # A client may replace its own stale connection, never another user's
+        if previous and previous.user_id != user_id:
+            raise PermissionError(f"Client id {client_id} is in use")
+
         await websocket.accept()
-        self.active_connections[client_id] = websocket
+        if previous:
+            await self._close(previous)
+        connection = ClientConnection(websocket, client_id, self.max_queue_size, user_id)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self.active_connections[client_id] = connection
+        self._by_websocket[id(websocket)] = connection
+        if user_id:
+            self._user_clients.setdefault(user_id, set()).add(client_id)
         logger.info(f"Client {client_id} connected. Total active connections: {len(self.active_connections)}")
-    
+
     def disconnect(self, websocket: WebSocket, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-            if client_id in self.typing_users:
-                self.typing_users.remove(client_id)
+        connection = self.active_connections.get(client_id)
+        if connection and connection.websocket is websocket:
+            self._remove(connection)
         logger.info(f"Client {client_id} disconnected. Total active connections: {len(self.active_connections)}")
-    
+
     async def send_personal_message(self, message: dict, websocket: WebSocket):
+        """
+        Queue a message for one client, waiting while its backlog is full
+        """
+        connection = self._by_websocket.get(id(websocket))
+        if connection is None:
+            logger.error("Error sending personal message: connection is not active")
+            return
         try:
-            await websocket.send_text(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Error sending personal message: {str(e)}")
-    
+            await asyncio.wait_for(connection.queue.put(json.dumps(message)), timeout=self.send_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Client {connection.client_id} send queue full, disconnecting")
+            await self._close(connection, SLOW_CONSUMER_CLOSE_CODE)
+
+    async def send_to_user(self, user_id: str, message: dict):
+        """
+        Send a message to every connection of a user, on any node
+        """
+        text = json.dumps(message)
+        self._deliver_to_user(user_id, text)
+        await self._publish({"kind": "user", "user_id": user_id, "frame": text})
+
     async def broadcast_message(self, message: str):
         """
         Broadcast a message to all connected clients
         """
-        for client_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(json.dumps({
-                    "type": "broadcast",
-                    "content": message
-                }))
-            except Exception as e:
-                logger.error(f"Error broadcasting to client {client_id}: {str(e)}")
-                # Consider removing the failed connection
-                await self.handle_failed_connection(client_id)
-    
-    async def broadcast_typing(self, client_id: str, is_typing: bool):
+        text = json.dumps({
+            "type": "broadcast",
+            "content": message
+        })
+        self._fan_out(text)
+        await self._publish({"kind": "broadcast", "frame": text})
+
+    async def join_room(self, client_id: str, room: str):
+        """
+        Add a client to a room and announce its presence to the room
+        """
+        connection = self.active_connections.get(client_id)
+        if not connection or room in connection.rooms:
+            return
+        connection.rooms.add(room)
+        self._apply_presence(self.node_id, room, client_id, True)
+        await self._publish({"kind": "presence", "room": room, "client_id": client_id, "joined": True})
+
+    async def leave_room(self, client_id: str, room: str):
+        """
+        Remove a client from a room
+        """
+        connection = self.active_connections.get(client_id)
+        if not connection or room not in connection.rooms:
+            return
+        self._leave_local_room(connection, room)
+        await self._publish({"kind": "presence", "room": room, "client_id": client_id, "joined": False})
+
+    async def broadcast_typing(self, client_id: str, is_typing: bool, room: Optional[str] = None):
+        """
+        Update a client's typing status in one of its rooms, or in all of them.
+        Only changes are relayed, so repeated keystrokes cost nothing.
+        """
+        connection = self.active_connections.get(client_id)
+        if not connection:
+            return
+        rooms = [room] if room else list(connection.rooms)
+        for room in rooms:
+            if room in connection.rooms and self._set_typing(self.node_id, room, client_id, is_typing):
+                await self._publish({"kind": "typing", "room": room, "client_id": client_id, "is_typing": is_typing})
+
+    def room_members(self, room: str) -> Set[str]:
+        """
+        Clients in a room, on any node
+        """
+        return set().union(*(rooms.get(room, ()) for rooms in self._node_rooms.values()))
+
+    def room_typing(self, room: str) -> Set[str]:
+        """
+        Clients typing in a room, on any node
+        """
+        return set().union(*(rooms.get(room, ()) for rooms in self._node_typing.values()))
+
+    def _leave_local_room(self, connection: ClientConnection, room: str):
+        connection.rooms.discard(room)
+        self._apply_presence(self.node_id, room, connection.client_id, False)
+
+    def _apply_presence(self, node_id: str, room: str, client_id: str, joined: bool):
+        rooms = self._node_rooms.setdefault(node_id, {})
+        members = rooms.get(room, set())
+        if (client_id in members) == joined:
+            return
+        if joined:
+            rooms.setdefault(room, members).add(client_id)
+        else:
+            members.discard(client_id)
+            if not members:
+                rooms.pop(room, None)
+            self._set_typing(node_id, room, client_id, False)
+
+        self._fan_out_room(room, json.dumps({
+            "type": "presence",
+            "room": room,
+            "client_id": client_id,
+            "status": "joined" if joined else "left",
+            "members": sorted(self.room_members(room))
+        }))
+
+    def _set_typing(self, node_id: str, room: str, client_id: str, is_typing: bool) -> bool:
         """
-        Broadcast typing status to all clients except the sender
+        Record a typing change and schedule a coalesced update; False if nothing changed
         """
+        rooms = self._node_typing.setdefault(node_id, {})
+        typing = rooms.get(room, set())
+        if (client_id in typing) == is_typing:
+            return False
         if is_typing:
-            self.typing_users.add(client_id)
+            rooms.setdefault(room, typing).add(client_id)
         else:
-            self.typing_users.discard(client_id)
-        
-        typing_message = {
+            typing.discard(client_id)
+            if not typing:
+                rooms.pop(room, None)
+
+        if room not in self._typing_flush_pending:
+            self._typing_flush_pending.add(room)
+            self._spawn(self._flush_typing(room))
+        return True
+
+    async def _flush_typing(self, room: str):
+        await asyncio.sleep(self.typing_debounce)
+        self._typing_flush_pending.discard(room)
+        self._fan_out_room(room, json.dumps({
             "type": "typing_status",
-            "typing_users": list(self.typing_users)
-        }
-        
-        for cid, connection in self.active_connections.items():
-            if cid != client_id:  # Don't send back to the sender
-                try:
-                    await connection.send_text(json.dumps(typing_message))
-                except Exception as e:
-                    logger.error(f"Error broadcasting typing status to client {cid}: {str(e)}")
-                    await self.handle_failed_connection(cid)
-    
+            "room": room,
+            "typing_users": sorted(self.room_typing(room))
+        }))
+
+    def _fan_out_room(self, room: str, text: str):
+        for client_id in list(self._local_rooms.get(room, ())):
+            connection = self.active_connections.get(client_id)
+            if connection:
+                self._offer(connection, text)
+
+    def _deliver_to_user(self, user_id: str, text: str):
+        for client_id in list(self._user_clients.get(user_id, ())):
+            connection = self.active_connections.get(client_id)
+            if connection:
+                self._offer(connection, text)
+
+    async def _publish(self, event: dict):
+        await self.backplane.publish(json.dumps({**event, "origin": self.node_id}))
+
+    async def _on_backplane_message(self, raw: str):
+        """
+        Deliver an event published by another node to this node's clients
+        """
+        event = json.loads(raw)
+        origin = event.get("origin")
+        if not origin or origin == self.node_id:
+            return
+        kind = event.get("kind")
+        if kind == "node_down":
+            self._drop_node(origin)
+            return
+        self._node_seen[origin] = time.monotonic()
+        if kind == "broadcast":
+            self._fan_out(event["frame"])
+        elif kind == "presence":
+            self._apply_presence(origin, event["room"], event["client_id"], event["joined"])
+        elif kind == "typing":
+            self._set_typing(origin, event["room"], event["client_id"], event["is_typing"])
+        elif kind == "user":
+            self._deliver_to_user(event["user_id"], event["frame"])
+        elif kind == "snapshot":
+            self._apply_snapshot(origin, event["rooms"], event["typing"])
+        elif kind == "sync_request":
+            self._spawn(self._publish_snapshot())
+
+    async def _publish_snapshot(self):
+        await self._publish({
+            "kind": "snapshot",
+            "rooms": {room: sorted(clients) for room, clients in self._local_rooms.items()},
+            "typing": {room: sorted(clients) for room, clients in self._node_typing[self.node_id].items()}
+        })
+
+    def _apply_snapshot(self, node_id: str, rooms: Dict[str, List[str]], typing: Dict[str, List[str]]):
+        """
+        Replace what is known of another node's rooms with its snapshot,
+        announcing any differences
+        """
+        for room, clients in list(self._node_rooms.get(node_id, {}).items()):
+            for client_id in clients - set(rooms.get(room, ())):
+                self._apply_presence(node_id, room, client_id, False)
+        for room, clients in rooms.items():
+            for client_id in clients:
+                self._apply_presence(node_id, room, client_id, True)
+
+        for room, clients in list(self._node_typing.get(node_id, {}).items()):
+            for client_id in clients - set(typing.get(room, ())):
+                self._set_typing(node_id, room, client_id, False)
+        for room, clients in typing.items():
+            for client_id in clients:
+                self._set_typing(node_id, room, client_id, True)
+
+    def _drop_node(self, node_id: str):
+        """
+        Forget a node that shut down or went silent; its clients leave their rooms
+        """
+        self._node_seen.pop(node_id, None)
+        self._apply_snapshot(node_id, {}, {})
+        self._node_rooms.pop(node_id, None)
+        self._node_typing.pop(node_id, None)
+
+    async def _run_heartbeat(self):
+        """
+        Publish this node's rooms periodically and drop nodes that have gone silent
+        """
+        while True:
+            try:
+                await self._publish_snapshot()
+                await asyncio.sleep(self.heartbeat_interval)
+                deadline = time.monotonic() - self.node_timeout
+                for node_id, seen in list(self._node_seen.items()):
+                    if seen < deadline:
+                        logger.warning(f"No heartbeat from WebSocket node {node_id}, dropping its clients")
+                        self._drop_node(node_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket node heartbeat failed: {str(e)}")
+                await asyncio.sleep(self.heartbeat_interval)
+
+    async def close(self):
+        """
+        Stop relaying events, telling other nodes this node's clients are gone
+        """
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        if self._backplane_started:
+            await self._publish({"kind": "node_down"})
+        await self.backplane.close()
+
+    def _spawn(self, coroutine):
+        # Keep a reference so fire-and-forget tasks are not garbage collected
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _fan_out(self, text: str):
+        """
+        Queue an already serialized frame for every client; clients whose
+        backlog is full are disconnected rather than waited for
+        """
+        for connection in list(self.active_connections.values()):
+            self._offer(connection, text)
+
+    def _offer(self, connection: ClientConnection, text: str):
+        if not connection.offer(text):
+            logger.warning(f"Client {connection.client_id} send queue full, disconnecting")
+            self._remove(connection)
+            self._spawn(self._close(connection, SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _write(self, connection: ClientConnection):
+        """
+        Writer task: send queued frames to one client in order
+        """
+        try:
+            while True:
+                text = await connection.queue.get()
+                await connection.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending to client {connection.client_id}: {str(e)}")
+            await self.handle_failed_connection(connection.client_id)
+
+    async def _close(self, connection: ClientConnection, code: int = 1000):
+        self._remove(connection)
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            # Already closed by the client
+            pass
+
+    def _remove(self, connection: ClientConnection):
+        if self.active_connections.get(connection.client_id) is connection:
+            del self.active_connections[connection.client_id]
+            for room in list(connection.rooms):
+                self._leave_local_room(connection, room)
+                # Other nodes track room members too
+                self._spawn(self._publish({
+                    "kind": "presence", "room": room, "client_id": connection.client_id, "joined": False
+                }))
+            if connection.user_id:
+                clients = self._user_clients.get(connection.user_id, set())
+                clients.discard(connection.client_id)
+                if not clients:
+                    self._user_clients.pop(connection.user_id, None)
+        self._by_websocket.pop(id(connection.websocket), None)
+        if connection.writer and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
     async def handle_failed_connection(self, client_id: str):
         """
         Handle cleanup of failed connections
         """
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-            if client_id in self.typing_users:
-                self.typing_users.remove(client_id)
+        connection = self.active_connections.get(client_id)
+        if connection:
+            self._remove(connection)
             logger.info(f"Removed failed connection for client {client_id}")
-    
+
     def get_active_connections_count(self) -> int:
         """
         Get the count of active connections
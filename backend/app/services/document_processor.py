@@ -1,25 +1,32 @@
 import os
-from typing import Dict, Any, Optional, List
+from typing import Awaitable, Callable, Dict, Any, Optional, List
 import magic
-import pytesseract
-from pdf2image import convert_from_path
+from pypdf import PdfReader
 import docx
 import asyncio
 import logging
 from pathlib import Path
-from .mistral_service import MistralService
+from .mistral_service import get_mistral_service
+from .ocr_service import OCRService
+from .cache_service import get_cache_service
+from .text_store import TextStore
+from .progress import ProcessingProgress
 from ..models.document import Document, DocumentStatus
 from sqlalchemy.orm import Session
 import aiofiles
 import hashlib
 import json
+import copy
 
 logger = logging.getLogger(__name__)
 
 class DocumentProcessor:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, ocr_workers: Optional[int] = None):
         self.db = db
-        self.mistral = MistralService()
+        self.mistral = get_mistral_service()
+        self.ocr = OCRService(ocr_workers)
+        self.cache = get_cache_service()
+        self.text_store = TextStore()
         self.allowed_types = {
             'application/pdf': '.pdf',
             'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
@@ -28,59 +35,284 @@ class DocumentProcessor:
         self.upload_dir = os.getenv('UPLOAD_DIR', './uploads')
         Path(self.upload_dir).mkdir(parents=True, exist_ok=True)
 
+        # Pages whose text layer has fewer meaningful characters than this are OCR'd
+        self.min_page_text_chars = int(os.getenv('PDF_MIN_PAGE_TEXT_CHARS', '25'))
+
+        self.analysis_types = ["summary", "entities", "clauses", "risk_analysis"]
+        self._progress: Dict[str, ProcessingProgress] = {}
+
     async def process_document(self, document: Document, file_path: str) -> Dict[str, Any]:
         """
-        Main document processing pipeline
+        Main document processing pipeline, running every stage in this process
         """
         try:
-            # Update status to processing
-            document.update_status(DocumentStatus.PROCESSING)
-            self.db.commit()
+            state = await self.start_processing(document, file_path)
+            state = await self.extract_text_layer(state)
+            state = await self.ocr_missing_pages(state)
+            state = await self.chunk_text(state)
+            state = await self.analyze_text(state)
+            return await self.finish_processing(document, state)
+
+        except Exception as e:
+            logger.error(f"Error processing document: {str(e)}")
+            await self.fail_processing(document, e)
+            raise
+
+    # Pipeline stages. Each takes and returns a JSON-serializable state dict so
+    # the stages can also run as separate Celery tasks; text, page texts and
+    # chunks are passed between them through the text store.
+
+    async def start_processing(self, document: Document, file_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Validate and hash a document, reusing the results of an identical upload
+        """
+        # Update status to processing
+        document.update_status(DocumentStatus.PROCESSING)
+        await self._commit(document)
+        self._progress[str(document.id)] = await ProcessingProgress.start(
+            self.cache, str(document.id), len(self.analysis_types)
+        )
+
+        # 1. Validate document
+        file_path = file_path or document.file_path
+        mime_type = await self._get_mime_type(file_path)
+        if mime_type not in self.allowed_types:
+            raise ValueError(f"Unsupported file type: {mime_type}")
+
+        # 2. Generate file hash
+        file_hash = await self._generate_file_hash(file_path)
+        document.file_hash = file_hash
+        document.metadata['file_hash'] = file_hash
+
+        state = {
+            "document_id": str(document.id),
+            "file_path": file_path,
+            "mime_type": mime_type,
+            "file_hash": file_hash
+        }
+
+        # 3. Reuse results of an identical, already processed upload
+        duplicate = await self._find_processed_duplicate(file_hash, document)
+        if duplicate:
+            logger.info(f"Document {document.id} has the same content as {duplicate.id}, reusing analysis")
+            state["analysis_results"] = copy.deepcopy(duplicate.analysis_results)
+            state["deduplicated_from"] = str(duplicate.id)
+            document.metadata['deduplicated_from'] = str(duplicate.id)
+            await self._progress[str(document.id)].set_stage("persisting")
+
+        await self._commit(document)
+        return state
+
+    async def extract_text_layer(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extract text without OCR. PDF pages lacking a usable text layer are
+        recorded in state["ocr_pages"] for the OCR stage.
+        """
+        if "analysis_results" in state or await self.text_store.exists(state["file_hash"]):
+            return state
+
+        if state["mime_type"] == 'application/pdf':
+            page_texts = await asyncio.to_thread(self._read_pdf_text_layer, state["file_path"])
+            ocr_pages = self._pages_needing_ocr(page_texts)
+            progress = await self._get_progress(state)
+            await progress.update(force=True, pages_total=len(page_texts), pages_ocr_total=len(ocr_pages))
+            if ocr_pages:
+                await self.text_store.put_artifact(state["file_hash"], "pages", page_texts)
+                return {**state, "ocr_pages": ocr_pages}
+            text = self._join_pages(page_texts)
+        else:
+            text = await self._extract_text(state["file_path"], state["mime_type"])
+
+        await self.text_store.put(state["file_hash"], text)
+        return state
 
-            # 1. Validate document
-            mime_type = await self._get_mime_type(file_path)
-            if mime_type not in self.allowed_types:
-                raise ValueError(f"Unsupported file type: {mime_type}")
-
-            # 2. Extract text
-            text = await self._extract_text(file_path, mime_type)
-
-            # 3. Generate file hash
-            file_hash = await self._generate_file_hash(file_path)
-            document.metadata['file_hash'] = file_hash
-
-            # 4. Process the document
-            tasks = [
-                self.mistral.analyze_document(text, "summary"),
-                self.mistral.analyze_document(text, "entities"),
-                self.mistral.analyze_document(text, "clauses"),
-                self.mistral.analyze_document(text, "risk_analysis")
-            ]
-            results = await asyncio.gather(*tasks)
-
-            # 5. Combine results
-            analysis_results = {
+    async def ocr_missing_pages(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        OCR the pages the extract stage found without a text layer and store the full text
+        """
+        ocr_pages = state.get("ocr_pages")
+        if not ocr_pages or await self.text_store.exists(state["file_hash"]):
+            return state
+
+        file_path = state["file_path"]
+        page_texts = await self.text_store.get_artifact(state["file_hash"], "pages")
+        if page_texts is None:
+            page_texts = await asyncio.to_thread(self._read_pdf_text_layer, file_path)
+
+        progress = await self._get_progress(state)
+        await progress.set_stage("ocr")
+        await self._ocr_pages(file_path, page_texts, ocr_pages, progress.page_ocr_done)
+
+        await self.text_store.put(state["file_hash"], self._join_pages(page_texts))
+        await self.text_store.delete_artifact(state["file_hash"], "pages")
+        return state
+
+    async def chunk_text(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Split texts too long for a single request into chunks for map-reduce analysis
+        """
+        if "analysis_results" in state:
+            return state
+
+        await (await self._get_progress(state)).set_stage("chunking")
+        chunks = self.mistral.plan_chunks(await self._load_stored_text(state))
+        if not chunks:
+            return state
+
+        await self.text_store.put_artifact(state["file_hash"], self._chunks_artifact(), chunks)
+        return {**state, "chunk_count": len(chunks)}
+
+    async def analyze_text(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Run every analysis of the stored text
+        """
+        if "analysis_results" in state:
+            return state
+
+        text = await self._load_stored_text(state)
+        chunks = None
+        if state.get("chunk_count"):
+            chunks = await self.text_store.get_artifact(state["file_hash"], self._chunks_artifact())
+
+        progress = await self._get_progress(state)
+        await progress.set_stage("analyzing")
+        results = await self.mistral.analyze_all(
+            text,
+            self.analysis_types,
+            chunks=chunks,
+            on_result=progress.analysis_done,
+            on_chunk=progress.chunk_done
+        )
+        if chunks is not None:
+            await self.text_store.delete_artifact(state["file_hash"], self._chunks_artifact())
+
+        return {
+            **state,
+            "analysis_results": {
                 result["analysis_type"]: result["result"]
                 for result in results
             }
+        }
 
-            # 6. Update document with results
-            document.analysis_results = analysis_results
-            document.update_status(DocumentStatus.PROCESSED)
-            self.db.commit()
+    async def finish_processing(self, document: Document, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Save the analysis results and mark the document processed
+        """
+        analysis_results = state["analysis_results"]
+        document.analysis_results = analysis_results
+        document.update_status(DocumentStatus.PROCESSED)
+        await self._commit(document)
 
-            return {
-                "status": "success",
-                "document_id": str(document.id),
-                "analysis_results": analysis_results
-            }
+        if "deduplicated_from" not in state:
+            await self.cache.set_document_id_by_hash(state["file_hash"], str(document.id))
 
-        except Exception as e:
-            logger.error(f"Error processing document: {str(e)}")
-            document.update_status(DocumentStatus.ERROR)
-            document.metadata['error'] = str(e)
+        await (await self._get_progress(state)).set_stage(
+            "completed",
+            analyses_done=len(analysis_results),
+            partial_results=analysis_results
+        )
+
+        return {
+            "status": "success",
+            "document_id": str(document.id),
+            "analysis_results": analysis_results
+        }
+
+    async def fail_processing(self, document: Document, error: BaseException):
+        """
+        Mark a document as failed
+        """
+        document.update_status(DocumentStatus.ERROR)
+        document.metadata['error'] = str(error)
+        await self._commit(document)
+        await (await self._get_progress({"document_id": str(document.id)})).set_stage("failed", error=str(error))
+
+    async def _commit(self, *instances):
+        """
+        Commit in a worker thread, reloading instances there too, so the
+        event loop never blocks on the database (also not on attribute
+        access to instances the commit expired)
+        """
+        def commit():
             self.db.commit()
-            raise
+            for instance in instances:
+                self.db.refresh(instance)
+
+        await asyncio.to_thread(commit)
+
+    async def _get_progress(self, state: Dict[str, Any]) -> ProcessingProgress:
+        """
+        Get the progress tracker of a document, resuming the one stored by earlier stages
+        """
+        document_id = state["document_id"]
+        if document_id not in self._progress:
+            self._progress[document_id] = await ProcessingProgress.load(self.cache, document_id)
+        return self._progress[document_id]
+
+    async def _load_stored_text(self, state: Dict[str, Any]) -> str:
+        """
+        Load the text the extract stages stored, re-extracting it if it has gone missing
+        """
+        text = await self.text_store.get(state["file_hash"])
+        if text is None:
+            text = await self._extract_text(state["file_path"], state["mime_type"])
+            await self.text_store.put(state["file_hash"], text)
+        return text
+
+    def _chunks_artifact(self) -> str:
+        # Chunks depend on the chunker settings, so key them by those too
+        return f"chunks-{self.mistral.chunker.max_tokens}-{self.mistral.chunker.overlap_tokens}"
+
+    async def _find_processed_duplicate(self, file_hash: str, document: Document) -> Optional[Document]:
+        """
+        Find another processed document with identical content, checking the
+        hash index cache before falling back to the database
+        """
+        cached_id = await self.cache.get_document_id_by_hash(file_hash)
+        if cached_id and cached_id != str(document.id):
+            duplicate = await asyncio.to_thread(self.db.query(Document).filter(
+                Document.id == cached_id,
+                Document.file_hash == file_hash,
+                Document.status == DocumentStatus.PROCESSED,
+                Document.deleted_at.is_(None)
+            ).first)
+            if duplicate and duplicate.analysis_results:
+                return duplicate
+
+        duplicate = await asyncio.to_thread(self.db.query(Document).filter(
+            Document.file_hash == file_hash,
+            Document.id != document.id,
+            Document.status == DocumentStatus.PROCESSED,
+            Document.deleted_at.is_(None)
+        ).order_by(Document.updated_at.desc()).first)
+        if duplicate and duplicate.analysis_results:
+            await self.cache.set_document_id_by_hash(file_hash, str(duplicate.id))
+            return duplicate
+        return None
+
+    async def get_document_text(
+        self,
+        document: Document,
+        file_path: Optional[str] = None,
+        mime_type: Optional[str] = None
+    ) -> str:
+        """
+        Get the extracted text of a document, extracting and persisting it
+        only the first time its content is seen
+        """
+        file_path = file_path or document.file_path
+        if not document.file_hash:
+            document.file_hash = await self._generate_file_hash(file_path)
+            document.metadata['file_hash'] = document.file_hash
+
+        text = await self.text_store.get(document.file_hash)
+        if text is not None:
+            return text
+
+        mime_type = mime_type or await self._get_mime_type(file_path)
+        text = await self._extract_text(file_path, mime_type)
+        await self.text_store.put(document.file_hash, text)
+        return text
 
     async def _extract_text(self, file_path: str, mime_type: str) -> str:
         """
@@ -98,34 +330,74 @@ class DocumentProcessor:
 
     async def _extract_text_from_pdf(self, file_path: str) -> str:
         """
-        Extract text from PDF using OCR if necessary
+        Extract text from PDF page by page, using OCR only for image-only pages
+        (extract_text_layer and ocr_missing_pages in one step)
         """
         try:
-            # Try to extract text directly first
-            async with aiofiles.open(file_path, 'rb') as file:
-                pdf_content = await file.read()
-                
-            # If no text is extracted, use OCR
-            if not pdf_content.strip():
-                images = await asyncio.to_thread(convert_from_path, file_path)
-                text_parts = []
-                
-                for image in images:
-                    text = await asyncio.to_thread(
-                        pytesseract.image_to_string,
-                        image,
-                        lang='eng'
-                    )
-                    text_parts.append(text)
-                
-                return '\n'.join(text_parts)
-            
-            return pdf_content.decode('utf-8', errors='ignore')
-            
+            page_texts = await asyncio.to_thread(self._read_pdf_text_layer, file_path)
+            ocr_pages = self._pages_needing_ocr(page_texts)
+            if ocr_pages:
+                await self._ocr_pages(file_path, page_texts, ocr_pages)
+            return self._join_pages(page_texts)
+
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {str(e)}")
             raise
 
+    async def _ocr_pages(
+        self,
+        file_path: str,
+        page_texts: List[str],
+        ocr_pages: List[int],
+        on_page: Optional[Callable[[int], Awaitable[None]]] = None
+    ):
+        """
+        OCR the given 1-based pages into page_texts, reporting the number of pages done
+        """
+        logger.info(f"OCR required for {len(ocr_pages)} of {len(page_texts)} pages in {file_path}")
+        pages_done = 0
+        async for page_number, page_text in self.ocr.iter_pages(file_path, ocr_pages):
+            page_texts[page_number - 1] = page_text
+            pages_done += 1
+            if on_page:
+                await on_page(pages_done)
+
+    def _pages_needing_ocr(self, page_texts: List[str]) -> List[int]:
+        """
+        1-based numbers of the pages without a usable text layer
+        """
+        return [
+            page_number
+            for page_number, page_text in enumerate(page_texts, start=1)
+            if self._needs_ocr(page_text)
+        ]
+
+    @staticmethod
+    def _join_pages(page_texts: List[str]) -> str:
+        return '\n\n'.join(text.strip() for text in page_texts if text.strip())
+
+    def _read_pdf_text_layer(self, file_path: str) -> List[str]:
+        """
+        Read the embedded text layer of each PDF page
+        """
+        reader = PdfReader(file_path)
+        page_texts = []
+        for page in reader.pages:
+            try:
+                page_texts.append(page.extract_text() or '')
+            except Exception as e:
+                # A single malformed content stream should only cost us that page
+                logger.warning(f"Could not read text layer of page in {file_path}: {str(e)}")
+                page_texts.append('')
+        return page_texts
+
+    def _needs_ocr(self, page_text: str) -> bool:
+        """
+        Decide whether a page has no usable text layer (scanned or image-only)
+        """
+        meaningful_chars = sum(1 for char in page_text if char.isalnum())
+        return meaningful_chars < self.min_page_text_chars
+
     async def _extract_text_from_docx(self, file_path: str) -> str:
         """
         Extract text from DOCX files
@@ -166,8 +438,8 @@ class DocumentProcessor:
         Compare two versions of a document
         """
         try:
-            text1 = await self._extract_text(doc1.file_path, doc1.file_type)
-            text2 = await self._extract_text(doc2.file_path, doc2.file_type)
+            text1 = await self.get_document_text(doc1)
+            text2 = await self.get_document_text(doc2)
             
             comparison_result = await self.mistral.compare_documents(text1, text2)
             
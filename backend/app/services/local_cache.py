@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class LocalCache:
+    """
+    In-process LRU cache with per-entry TTL and a total size limit in bytes.
+    Values are stored as serialized payloads so callers never share mutable objects.
+    """
+
+    def __init__(self, max_bytes: int, default_ttl: float):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a payload, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, size, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, key: str, payload: Any, ttl: Optional[float] = None):
+        """
+        Store a payload, evicting least recently used entries to stay within max_bytes
+        """
+        size = len(payload)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (payload, size, time.monotonic() + (ttl or self.default_ttl))
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_matching(self, predicate: Callable[[str], bool]):
+        """
+        Remove every entry whose key matches the predicate
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes
+            }
+
+
+_local_cache: Optional[LocalCache] = None
+
+
+def get_local_cache() -> Optional[LocalCache]:
+    """
+    Get the process-wide local cache tier, or None when it is disabled
+    """
+    global _local_cache
+    if os.getenv("LOCAL_CACHE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+    if _local_cache is None:
+        _local_cache = LocalCache(
+            max_bytes=int(os.getenv("LOCAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            default_ttl=float(os.getenv("LOCAL_CACHE_TTL_SECONDS", "60"))
+        )
+    return _local_cache
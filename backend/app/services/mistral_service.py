@@ -1,19 +1,82 @@
-from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
 from mistralai.models.chat_completion import ChatMessage
-from typing import List, Dict, Any, Optional
+from mistralai.exceptions import MistralAPIException, MistralConnectionException
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Any, Optional, Tuple
 import os
+import re
+import json
+import asyncio
+import random
+import hashlib
 from dotenv import load_dotenv
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
+from .text_chunker import TextChunker
+from .rate_limiter import Priority, get_rate_limiter
+from .cache_service import get_cache_service
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Process-wide client and service shared by every caller
+_client: Optional[MistralAsyncClient] = None
+_service: Optional["MistralService"] = None
+
+# Progress callbacks: (analysis_type, chunks_done, chunks_total) as map-reduce
+# chunks finish, and each analysis result as soon as it is available
+ChunkProgressCallback = Callable[[str, int, int], Awaitable[None]]
+ResultCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Chunks of two documents sharing less of their vocabulary than this are not compared with each other
+MIN_CHUNK_SIMILARITY = 0.2
+
+
+def get_mistral_client() -> MistralAsyncClient:
+    """
+    Get the shared async Mistral client, whose HTTP connection pool is reused by all requests
+    """
+    global _client
+    if _client is None:
+        _client = MistralAsyncClient(
+            api_key=os.getenv("MISTRAL_API_KEY"),
+            max_retries=0,
+            timeout=int(os.getenv("MISTRAL_REQUEST_TIMEOUT", "120")),
+            max_concurrent_requests=int(os.getenv("MISTRAL_HTTP_POOL_SIZE", "64"))
+        )
+    return _client
+
+
+def get_mistral_service() -> "MistralService":
+    """
+    Get the shared MistralService
+    """
+    global _service
+    if _service is None:
+        _service = MistralService()
+    return _service
+
+
+async def close_mistral_client():
+    """
+    Close the shared client's HTTP connections
+    """
+    global _client, _service
+    if _client is not None:
+        await _client.close()
+        _client = None
+        _service = None
+
 class MistralService:
     def __init__(self):
         self.api_key = os.getenv("MISTRAL_API_KEY")
         self.model = os.getenv("MISTRAL_MODEL", "mistral-medium")
-        self.client = MistralClient(api_key=self.api_key)
+        self.client = get_mistral_client()
+        self.request_timeout = float(os.getenv("MISTRAL_REQUEST_TIMEOUT", "120"))
+        # Longest wait for the next token of a streamed response
+        self.stream_idle_timeout = float(os.getenv("MISTRAL_STREAM_IDLE_TIMEOUT", "30"))
+        self.max_retries = int(os.getenv("MISTRAL_MAX_RETRIES", "4"))
+        self.max_backoff = float(os.getenv("MISTRAL_MAX_BACKOFF", "60"))
+        self.cache = get_cache_service()
+        self.response_cache_enabled = os.getenv("LLM_RESPONSE_CACHE", "true").lower() in ("1", "true", "yes")
 
         # System prompts for different analysis types
         self.ANALYSIS_PROMPTS = {
@@ -31,8 +94,110 @@ class MistralService:
             business, and compliance risks. Rate each risk on a scale of 1-5 and provide mitigation suggestions."""
         }
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    async def analyze_document(self, text: str, analysis_type: str, context: Optional[Dict] = None) -> Dict[str, Any]:
+        # Prompts used to merge partial analyses of document chunks
+        self.REDUCE_PROMPTS = {
+            "summary": """Synthesize the following summaries of consecutive parts of one legal document into a 
+            single coherent summary of the whole document. Keep key points, obligations and risks. Format your response in markdown.""",
+
+            "entities": """Merge the following entity lists extracted from consecutive parts of one legal document 
+            into a single list. Deduplicate entities, keep their roles and relationships, and keep jurisdiction information.""",
+
+            "clauses": """Merge the following clause analyses extracted from consecutive parts of one legal document 
+            into a single list of clauses. Deduplicate clauses that span parts and keep the per-clause structure.""",
+
+            "risk_analysis": """Merge the following risk analyses of consecutive parts of one legal document into a 
+            single risk analysis. Deduplicate risks, keep the highest rating for repeated risks, and keep mitigation suggestions.""",
+
+            "comparison": """Merge the following comparisons of corresponding parts of two versions of a legal document 
+            into a single comparison. Keep the sections for differences in terms, obligations and rights, added or removed 
+            clauses, and changes in risk profile. Format your response in markdown."""
+        }
+
+        # Context budget and map-reduce settings
+        self.max_output_tokens = 2000
+        self.context_tokens = int(os.getenv("MISTRAL_CONTEXT_TOKENS", "32000"))
+        self.chunk_tokens = int(os.getenv("MISTRAL_CHUNK_TOKENS", "6000"))
+        self.map_concurrency = int(os.getenv("MISTRAL_MAP_CONCURRENCY", "4"))
+        self.reduce_fan_in = max(2, int(os.getenv("MISTRAL_REDUCE_FAN_IN", "6")))
+        self.chunker = TextChunker(
+            max_tokens=self.chunk_tokens,
+            overlap_tokens=int(os.getenv("MISTRAL_CHUNK_OVERLAP_TOKENS", "200")),
+            model=self.model
+        )
+
+        # "single" always sends the whole text, "map_reduce" chunks texts that don't fit the context
+        self.ANALYSIS_MODES = {analysis_type: "map_reduce" for analysis_type in self.ANALYSIS_PROMPTS}
+        self.ANALYSIS_MODES.update(self._parse_analysis_modes(os.getenv("MISTRAL_ANALYSIS_MODES", "")))
+
+        # Request all analyses in one structured response instead of one call per type
+        self.combined_analysis = os.getenv("MISTRAL_COMBINED_ANALYSIS", "false").lower() in ("1", "true", "yes")
+        self.combined_max_tokens = int(os.getenv("MISTRAL_COMBINED_MAX_TOKENS", "6000"))
+
+    @staticmethod
+    def _parse_analysis_modes(value: str) -> Dict[str, str]:
+        """
+        Parse per-type mode overrides like "summary=map_reduce,clauses=single"
+        """
+        modes = {}
+        for item in value.split(","):
+            if "=" not in item:
+                continue
+            analysis_type, mode = (part.strip() for part in item.split("=", 1))
+            if mode in ("single", "map_reduce"):
+                modes[analysis_type] = mode
+            else:
+                logger.warning(f"Ignoring unknown analysis mode {mode!r} for {analysis_type}")
+        return modes
+
+    def _estimate_tokens(self, text: str) -> int:
+        """
+        Count the tokens in a text with the model tokenizer
+        """
+        return self.chunker.count_tokens(text)
+
+    def _fits_in_context(self, text: str) -> bool:
+        """
+        Check whether a text can be sent in one request alongside the prompt and the response
+        """
+        return self._estimate_tokens(text) + self.max_output_tokens + 500 <= self.context_tokens
+
+    def plan_chunks(self, text: str) -> Optional[List[str]]:
+        """
+        Split a text for map-reduce analysis ahead of time, or return None if
+        no configured analysis would chunk it
+        """
+        if "map_reduce" not in self.ANALYSIS_MODES.values() or self._fits_in_context(text):
+            return None
+        return self.chunker.split(text)
+
+    async def analyze(
+        self,
+        text: str,
+        analysis_type: str,
+        context: Optional[Dict] = None,
+        chunks: Optional[List[str]] = None,
+        priority: Priority = Priority.BACKGROUND,
+        use_cache: bool = True,
+        on_chunk: Optional[ChunkProgressCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Analyze a document with the mode configured for the analysis type
+        """
+        mode = self.ANALYSIS_MODES.get(analysis_type, "single")
+        if mode == "map_reduce" and (chunks is not None or not self._fits_in_context(text)):
+            return await self.analyze_map_reduce(
+                text, analysis_type, context, chunks, priority, use_cache, on_chunk
+            )
+        return await self.analyze_document(text, analysis_type, context, priority, use_cache)
+
+    async def analyze_document(
+        self,
+        text: str,
+        analysis_type: str,
+        context: Optional[Dict] = None,
+        priority: Priority = Priority.BACKGROUND,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
         """
         Analyze a document using Mistral AI
         """
@@ -49,47 +214,383 @@ class MistralService:
                 context_msg = f"Additional context: {str(context)}"
                 messages.insert(1, ChatMessage(role="system", content=context_msg))
 
-            response = await self.client.chat_completions(
-                model=self.model,
-                messages=messages,
-                temperature=0.3,
-                max_tokens=2000
+            completion = await self._complete(
+                messages,
+                max_tokens=self.max_output_tokens,
+                priority=priority,
+                use_cache=use_cache
             )
 
             return {
                 "analysis_type": analysis_type,
-                "result": response.choices[0].message.content,
+                "result": completion["content"],
                 "model_used": self.model,
-                "metadata": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
+                "metadata": self._completion_metadata(completion)
             }
 
         except Exception as e:
             logger.error(f"Error in Mistral analysis: {str(e)}")
             raise
 
+    async def _complete(
+        self,
+        messages: List[ChatMessage],
+        max_tokens: int,
+        temperature: float = 0.3,
+        priority: Priority = Priority.BACKGROUND,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Get a completion, serving identical prompts from the response cache
+        """
+        cache_key = None
+        if use_cache and self.response_cache_enabled:
+            cache_key = self._prompt_hash(messages, max_tokens, temperature)
+            cached = await self.cache.get_llm_response(cache_key)
+            if cached:
+                return {**cached, "cached": True}
+
+        response = await self._chat(messages, max_tokens, temperature, priority)
+        completion = {
+            "content": response.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens
+            }
+        }
+        if cache_key:
+            await self.cache.set_llm_response(cache_key, completion)
+        return {**completion, "cached": False}
+
+    def _prompt_hash(self, messages: List[ChatMessage], max_tokens: int, temperature: float) -> str:
+        """
+        Hash a request with whitespace-normalized message contents
+        """
+        normalized = json.dumps([
+            self.model,
+            temperature,
+            max_tokens,
+            [[message.role, " ".join(message.content.split())] for message in messages]
+        ])
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _completion_metadata(completion: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Token usage metadata of a completion
+        """
+        return {**completion["usage"], "cached": completion["cached"]}
+
+    async def _chat(
+        self,
+        messages: List[ChatMessage],
+        max_tokens: int,
+        temperature: float = 0.3,
+        priority: Priority = Priority.BACKGROUND
+    ):
+        """
+        Send a chat completion request through the shared client and rate limiter,
+        retrying rate limits, server errors and timeouts with backoff
+        """
+        limiter = get_rate_limiter()
+        estimated_tokens = sum(self._estimate_tokens(message.content) for message in messages) + max_tokens
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with limiter.slot(estimated_tokens, priority):
+                    response = await asyncio.wait_for(
+                        self.client.chat(
+                            model=self.model,
+                            messages=messages,
+                            temperature=temperature,
+                            max_tokens=max_tokens
+                        ),
+                        timeout=self.request_timeout
+                    )
+                limiter.record_usage(estimated_tokens, response.usage.total_tokens)
+                return response
+
+            except MistralAPIException as e:
+                status = getattr(e, "http_status", None)
+                retryable = status == 429 or (status is not None and status >= 500)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                if status == 429:
+                    # Pause every caller in this process, not just this request
+                    await limiter.throttle(self._retry_after(e) or self._backoff(attempt))
+                else:
+                    await asyncio.sleep(self._backoff(attempt))
+
+            except (MistralConnectionException, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Mistral request failed ({type(e).__name__}), retrying: {str(e)}")
+                await asyncio.sleep(self._backoff(attempt))
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        Exponential backoff with jitter
+        """
+        return min(self.max_backoff, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _retry_after(error: MistralAPIException) -> Optional[float]:
+        """
+        Read the Retry-After header of a rate limited response
+        """
+        headers = getattr(error, "headers", None) or {}
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    async def analyze_all(
+        self,
+        text: str,
+        analysis_types: Optional[List[str]] = None,
+        context: Optional[Dict] = None,
+        use_cache: bool = True,
+        chunks: Optional[List[str]] = None,
+        on_result: Optional[ResultCallback] = None,
+        on_chunk: Optional[ChunkProgressCallback] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Run several analyses of a document, in a single combined request when
+        enabled and falling back to one request per analysis type. Precomputed
+        chunks (see plan_chunks) are reused by map-reduce analyses.
+        """
+        analysis_types = analysis_types or list(self.ANALYSIS_PROMPTS)
+        combined_fits = (
+            self._estimate_tokens(text) + self.combined_max_tokens + 1000 <= self.context_tokens
+        )
+        if self.combined_analysis and len(analysis_types) > 1 and combined_fits:
+            try:
+                results = await self.analyze_combined(text, analysis_types, context, use_cache)
+            except ValueError as e:
+                logger.warning(f"Combined analysis unusable, falling back to per-type analysis: {str(e)}")
+            else:
+                if on_result:
+                    for result in results:
+                        await on_result(result)
+                return results
+
+        async def run(analysis_type: str) -> Dict[str, Any]:
+            result = await self.analyze(
+                text, analysis_type, context, chunks, use_cache=use_cache, on_chunk=on_chunk
+            )
+            if on_result:
+                await on_result(result)
+            return result
+
+        return list(await asyncio.gather(*[run(analysis_type) for analysis_type in analysis_types]))
+
+    async def analyze_combined(
+        self,
+        text: str,
+        analysis_types: List[str],
+        context: Optional[Dict] = None,
+        use_cache: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Run several analyses in one request that returns a JSON object keyed by analysis type.
+        Raises ValueError if the response cannot be parsed into every requested analysis.
+        """
+        instructions = "\n\n".join(
+            f"- \"{analysis_type}\": {self.ANALYSIS_PROMPTS[analysis_type]}"
+            for analysis_type in analysis_types
+        )
+        system_prompt = f"""You are a legal document analyzer. Perform each of the following analyses of the document.
+        Respond with only a single JSON object whose keys are exactly {json.dumps(analysis_types)}. The value for each key
+        must be a string containing that analysis formatted in markdown.
+
+{instructions}"""
+
+        messages = [
+            ChatMessage(role="system", content=system_prompt),
+            ChatMessage(role="user", content=text)
+        ]
+        if context:
+            messages.insert(1, ChatMessage(role="system", content=f"Additional context: {str(context)}"))
+
+        completion = await self._complete(messages, max_tokens=self.combined_max_tokens, use_cache=use_cache)
+        parsed = self._parse_combined_response(completion["content"], analysis_types)
+
+        # The request's token usage is reported once, on the first analysis, so
+        # that summing usage across the results counts it exactly once
+        usage = self._completion_metadata(completion)
+        no_usage = {key: 0 for key in completion["usage"]}
+        return [
+            {
+                "analysis_type": analysis_type,
+                "result": parsed[analysis_type],
+                "model_used": self.model,
+                "metadata": {
+                    **(usage if index == 0 else {**usage, **no_usage}),
+                    "mode": "combined",
+                    "combined_analysis_types": analysis_types
+                }
+            }
+            for index, analysis_type in enumerate(analysis_types)
+        ]
+
+    @staticmethod
+    def _parse_combined_response(content: str, analysis_types: List[str]) -> Dict[str, str]:
+        """
+        Parse a combined analysis response into one markdown string per analysis type
+        """
+        content = content.strip()
+        # Values are markdown and may contain fenced blocks of their own, so
+        # only strip a fence that wraps the whole reply
+        fenced = re.fullmatch(r"```(?:json)?\s*(.*?)\s*```", content, re.DOTALL)
+        candidates = [content]
+        if fenced:
+            candidates.append(fenced.group(1))
+        start, end = content.find("{"), content.rfind("}")
+        if start != -1 and end > start:
+            candidates.append(content[start:end + 1])
+
+        for candidate in candidates:
+            try:
+                data = json.loads(candidate)
+                break
+            except json.JSONDecodeError as e:
+                error = e
+        else:
+            raise ValueError(f"Response is not valid JSON: {str(error)}")
+        if not isinstance(data, dict):
+            raise ValueError("Response is not a JSON object")
+
+        missing = [analysis_type for analysis_type in analysis_types if not data.get(analysis_type)]
+        if missing:
+            raise ValueError(f"Response is missing analyses: {', '.join(missing)}")
+
+        return {
+            analysis_type: data[analysis_type] if isinstance(data[analysis_type], str)
+            else json.dumps(data[analysis_type], indent=2)
+            for analysis_type in analysis_types
+        }
+
+    async def analyze_map_reduce(
+        self,
+        text: str,
+        analysis_type: str,
+        context: Optional[Dict] = None,
+        chunks: Optional[List[str]] = None,
+        priority: Priority = Priority.BACKGROUND,
+        use_cache: bool = True,
+        on_chunk: Optional[ChunkProgressCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        Analyze chunks concurrently, then merge the partial analyses hierarchically
+        """
+        if chunks is None:
+            chunks = self.chunker.split(text)
+        if not chunks:
+            raise ValueError("Cannot analyze an empty document")
+        if len(chunks) == 1:
+            return await self.analyze_document(chunks[0], analysis_type, context, priority, use_cache)
+
+        semaphore = asyncio.Semaphore(self.map_concurrency)
+        chunks_done = 0
+
+        async def analyze_chunk(index: int, chunk: str) -> Dict[str, Any]:
+            nonlocal chunks_done
+            chunk_context = dict(context or {})
+            chunk_context["document_part"] = f"{index + 1} of {len(chunks)}"
+            async with semaphore:
+                analysis = await self.analyze_document(chunk, analysis_type, chunk_context, priority, use_cache)
+            chunks_done += 1
+            if on_chunk:
+                await on_chunk(analysis_type, chunks_done, len(chunks))
+            return analysis
+
+        analyses = await asyncio.gather(*[
+            analyze_chunk(index, chunk) for index, chunk in enumerate(chunks)
+        ])
+        usage = self._sum_usage(analyses)
+
+        analysis, usage, reduce_levels = await self._reduce_hierarchically(
+            analyses, analysis_type, semaphore, usage, use_cache
+        )
+
+        return {
+            "analysis_type": analysis_type,
+            "result": analysis["result"],
+            "model_used": self.model,
+            "metadata": {
+                **usage,
+                "mode": "map_reduce",
+                "original_chunks": len(chunks),
+                "reduce_levels": reduce_levels
+            }
+        }
+
     async def process_large_document(self, text: str, chunk_size: int = 4000) -> Dict[str, Any]:
         """
-        Process a large document by breaking it into chunks and analyzing each chunk
+        Process a large document by breaking it into chunks of chunk_size tokens
+        (not characters) and analyzing each chunk
         """
+        if not text.strip():
+            raise ValueError("Cannot analyze an empty document")
         chunks = self._split_text(text, chunk_size)
-        analyses = []
+        return await self.analyze_map_reduce(text, "summary", chunks=chunks)
 
-        for chunk in chunks:
-            chunk_analysis = await self.analyze_document(chunk, "summary")
-            analyses.append(chunk_analysis)
+    async def _reduce_hierarchically(
+        self,
+        analyses: List[Dict[str, Any]],
+        analysis_type: str,
+        semaphore: asyncio.Semaphore,
+        usage: Dict[str, int],
+        use_cache: bool = True
+    ) -> Tuple[Dict[str, Any], Dict[str, int], int]:
+        """
+        Merge analyses in groups of reduce_fan_in until a single analysis remains
+        """
+        if not analyses:
+            raise ValueError("No analyses to merge")
 
-        # Combine the analyses
-        combined_analysis = self._combine_analyses(analyses)
-        return combined_analysis
+        async def reduce_group(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+            if len(group) == 1:
+                return group[0]
+            async with semaphore:
+                return await self._combine_analyses(group, analysis_type, use_cache)
 
-    async def compare_documents(self, doc1: str, doc2: str) -> Dict[str, Any]:
+        reduce_levels = 0
+        while len(analyses) > 1:
+            groups = [
+                analyses[start:start + self.reduce_fan_in]
+                for start in range(0, len(analyses), self.reduce_fan_in)
+            ]
+            reduced = await asyncio.gather(*[reduce_group(group) for group in groups])
+            usage = self._sum_usage(
+                [analysis for analysis, group in zip(reduced, groups) if len(group) > 1],
+                usage
+            )
+            analyses = list(reduced)
+            reduce_levels += 1
+
+        return analyses[0], usage, reduce_levels
+
+    @staticmethod
+    def _sum_usage(analyses: List[Dict[str, Any]], usage: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """
+        Add the token usage of analyses to a running total
+        """
+        usage = dict(usage or {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+        for analysis in analyses:
+            for key in usage:
+                usage[key] += analysis.get("metadata", {}).get(key, 0)
+        return usage
+
+    async def compare_documents(self, doc1: str, doc2: str, use_cache: bool = True) -> Dict[str, Any]:
         """
         Compare two documents and identify key differences
         """
+        if not self._fits_in_context(f"{doc1}\n\n{doc2}"):
+            return await self._compare_chunked(doc1, doc2, use_cache)
+
         comparison_prompt = """Compare the following two legal documents. Identify:
         1. Key differences in terms and conditions
         2. Changes in obligations or rights
@@ -102,71 +603,237 @@ class MistralService:
             ChatMessage(role="user", content=f"Document 1:\n{doc1}\n\nDocument 2:\n{doc2}")
         ]
 
-        response = await self.client.chat_completions(
-            model=self.model,
-            messages=messages,
-            temperature=0.3,
-            max_tokens=2000
+        completion = await self._complete(messages, max_tokens=self.max_output_tokens, use_cache=use_cache)
+
+        return {
+            "analysis_type": "comparison",
+            "result": completion["content"],
+            "model_used": self.model,
+            "metadata": self._completion_metadata(completion)
+        }
+
+    async def _compare_chunked(self, doc1: str, doc2: str, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Compare corresponding chunks of two long documents concurrently and merge the comparisons
+        """
+        half_budget = max(1, self.chunk_tokens // 2)
+        chunks1 = self._split_text(doc1, half_budget)
+        chunks2 = self._split_text(doc2, half_budget)
+        pairs = self._align_chunks(chunks1, chunks2)
+        semaphore = asyncio.Semaphore(self.map_concurrency)
+
+        async def compare_pair(part1: str, part2: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.compare_documents(part1, part2, use_cache)
+
+        comparisons = await asyncio.gather(*[compare_pair(part1, part2) for part1, part2 in pairs])
+        usage = self._sum_usage(comparisons)
+
+        comparison, usage, _ = await self._reduce_hierarchically(
+            comparisons, "comparison", semaphore, usage, use_cache
         )
 
         return {
             "analysis_type": "comparison",
-            "result": response.choices[0].message.content,
+            "result": comparison["result"],
             "model_used": self.model,
             "metadata": {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
+                **usage,
+                "mode": "map_reduce",
+                "original_chunks": len(pairs)
             }
         }
 
-    def _split_text(self, text: str, chunk_size: int) -> List[str]:
+    @staticmethod
+    def _align_chunks(chunks1: List[str], chunks2: List[str]) -> List[Tuple[str, str]]:
         """
-        Split text into chunks of specified size while preserving paragraph structure
+        Pair up corresponding chunks of two documents by content rather than
+        position, so an inserted or removed clause does not shift every later
+        pair. Chunks without a counterpart are paired with an empty string.
         """
-        paragraphs = text.split('\n\n')
-        chunks = []
-        current_chunk = ""
+        words1 = [set(re.findall(r"\w+", chunk.lower())) for chunk in chunks1]
+        words2 = [set(re.findall(r"\w+", chunk.lower())) for chunk in chunks2]
+
+        def similarity(i: int, j: int) -> float:
+            union = words1[i] | words2[j]
+            return len(words1[i] & words2[j]) / len(union) if union else 1.0
+
+        # Order-preserving alignment maximizing the total similarity of matched pairs
+        rows, columns = len(chunks1), len(chunks2)
+        scores = [[0.0] * (columns + 1) for _ in range(rows + 1)]
+        for i in range(rows - 1, -1, -1):
+            for j in range(columns - 1, -1, -1):
+                best = max(scores[i + 1][j], scores[i][j + 1])
+                score = similarity(i, j)
+                if score >= MIN_CHUNK_SIMILARITY:
+                    best = max(best, scores[i + 1][j + 1] + score)
+                scores[i][j] = best
 
-        for paragraph in paragraphs:
-            if len(current_chunk) + len(paragraph) <= chunk_size:
-                current_chunk += paragraph + "\n\n"
+        pairs: List[Tuple[str, str]] = []
+        i = j = 0
+        while i < rows and j < columns:
+            score = similarity(i, j)
+            if score >= MIN_CHUNK_SIMILARITY and scores[i][j] == scores[i + 1][j + 1] + score:
+                pairs.append((chunks1[i], chunks2[j]))
+                i, j = i + 1, j + 1
+            elif scores[i][j] == scores[i + 1][j]:
+                pairs.append((chunks1[i], ""))
+                i += 1
             else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = paragraph + "\n\n"
+                pairs.append(("", chunks2[j]))
+                j += 1
+        pairs.extend((chunk, "") for chunk in chunks1[i:])
+        pairs.extend(("", chunk) for chunk in chunks2[j:])
+        return pairs
 
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Answer a chat conversation, given as a list of {"role", "content"} messages
+        """
+        chat_messages = [ChatMessage(role=message["role"], content=message["content"]) for message in messages]
+        completion = await self._complete(
+            chat_messages,
+            max_tokens=max_tokens or self.max_output_tokens,
+            temperature=temperature,
+            priority=Priority.INTERACTIVE,
+            use_cache=use_cache
+        )
 
-        return chunks
+        return {
+            "content": completion["content"],
+            "model_used": self.model,
+            "metadata": self._completion_metadata(completion)
+        }
 
-    def _combine_analyses(self, analyses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def stream_chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Answer a chat conversation, yielding the response text incrementally as it is generated
+        """
+        chat_messages = [ChatMessage(role=message["role"], content=message["content"]) for message in messages]
+        max_tokens = max_tokens or self.max_output_tokens
+
+        cache_key = None
+        if use_cache and self.response_cache_enabled:
+            cache_key = self._prompt_hash(chat_messages, max_tokens, temperature)
+            cached = await self.cache.get_llm_response(cache_key)
+            if cached:
+                yield cached["content"]
+                return
+
+        limiter = get_rate_limiter()
+        estimated_tokens = sum(self._estimate_tokens(message.content) for message in chat_messages) + max_tokens
+        parts: List[str] = []
+        usage = None
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with limiter.slot(estimated_tokens, Priority.INTERACTIVE):
+                    stream = self.client.chat_stream(
+                        model=self.model,
+                        messages=chat_messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens
+                    )
+                    stream_iterator = stream.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(
+                                stream_iterator.__anext__(),
+                                timeout=self.stream_idle_timeout
+                            )
+                        except StopAsyncIteration:
+                            break
+                        usage = getattr(chunk, "usage", None) or usage
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+                break
+
+            except MistralAPIException as e:
+                status = getattr(e, "http_status", None)
+                # Once tokens have been sent to the caller the request cannot be replayed
+                if parts or status != 429 or attempt == self.max_retries:
+                    raise
+                await limiter.throttle(self._retry_after(e) or self._backoff(attempt))
+
+            except MistralConnectionException:
+                if parts or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+
+        content = "".join(parts)
+        if usage:
+            usage_info = {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens
+            }
+        else:
+            prompt_tokens = estimated_tokens - max_tokens
+            completion_tokens = self._estimate_tokens(content)
+            usage_info = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        limiter.record_usage(estimated_tokens, usage_info["total_tokens"])
+
+        if cache_key:
+            await self.cache.set_llm_response(cache_key, {"content": content, "usage": usage_info})
+
+    def _split_text(self, text: str, chunk_size: int) -> List[str]:
+        """
+        Split text into chunks of at most chunk_size tokens at clause and section boundaries
+        """
+        if chunk_size == self.chunker.max_tokens:
+            return self.chunker.split(text)
+        return TextChunker(
+            max_tokens=chunk_size,
+            overlap_tokens=min(self.chunker.overlap_tokens, chunk_size // 4),
+            token_counter=self.chunker.count_tokens
+        ).split(text)
+
+    async def _combine_analyses(
+        self,
+        analyses: List[Dict[str, Any]],
+        analysis_type: str = "summary",
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
         """
         Combine multiple analyses into a single coherent analysis
         """
-        combined_text = "\n\n".join([analysis["result"] for analysis in analyses])
-        
+        combined_text = "\n\n".join([
+            f"Part {index + 1}:\n{analysis['result']}"
+            for index, analysis in enumerate(analyses)
+        ])
+        reduce_prompt = self.REDUCE_PROMPTS.get(analysis_type, self.REDUCE_PROMPTS["summary"])
+
         messages = [
-            ChatMessage(role="system", content="Synthesize the following document analyses into a single coherent summary:"),
+            ChatMessage(role="system", content=reduce_prompt),
             ChatMessage(role="user", content=combined_text)
         ]
 
-        response = self.client.chat_completions(
-            model=self.model,
-            messages=messages,
-            temperature=0.3,
-            max_tokens=2000
-        )
+        completion = await self._complete(messages, max_tokens=self.max_output_tokens, use_cache=use_cache)
 
         return {
-            "analysis_type": "combined_analysis",
-            "result": response.choices[0].message.content,
+            "analysis_type": analysis_type,
+            "result": completion["content"],
             "model_used": self.model,
             "metadata": {
-                "original_chunks": len(analyses),
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
+                **self._completion_metadata(completion),
+                "original_chunks": len(analyses)
             }
         }
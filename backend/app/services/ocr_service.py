@@ -0,0 +1,139 @@
+import os
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Deque, List, Optional, Tuple
+import pytesseract
+from pdf2image import convert_from_path
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Get the process-wide OCR pool, creating it on first use
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers)
+            logger.info(f"Started OCR process pool with {max_workers} workers")
+        return _executor
+
+
+def shutdown_ocr_pool():
+    """
+    Shut down the process-wide OCR pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+def _ocr_page_range(file_path: str, first_page: int, last_page: int, language: str, dpi: int) -> List[str]:
+    """
+    Rasterize and OCR a contiguous page range inside a worker process.
+
+    Pages are rendered to a temporary directory rather than into memory, and
+    only one page image is open at a time.
+    """
+    with tempfile.TemporaryDirectory(prefix="ocr_") as output_folder:
+        image_paths = convert_from_path(
+            file_path,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=output_folder,
+            paths_only=True,
+            fmt="png"
+        )
+        texts = []
+        for image_path in image_paths:
+            with Image.open(image_path) as image:
+                texts.append(pytesseract.image_to_string(image, lang=language))
+            os.remove(image_path)
+        return texts
+
+
+class OCRService:
+    def __init__(self, max_workers: Optional[int] = None):
+        # With a single worker pages are OCR'd in this process, one range at a
+        # time, rather than in a process pool. Celery pipeline stages use that:
+        # the worker's own concurrency already spreads OCR over the cores, and
+        # prefork children cannot start process pools of their own.
+        self.max_workers = max_workers or int(os.getenv('OCR_WORKERS', str(os.cpu_count() or 1)))
+        self.pages_per_task = int(os.getenv('OCR_PAGES_PER_TASK', '4'))
+        # Bound on queued page ranges; keeps rendered pages and results from piling up
+        default_pending = self.max_workers * 2 if self.max_workers > 1 else 1
+        self.max_pending_tasks = int(os.getenv('OCR_MAX_PENDING_TASKS', str(default_pending)))
+        self.dpi = int(os.getenv('OCR_DPI', '300'))
+        self.language = os.getenv('OCR_LANGUAGE', 'eng')
+
+    async def iter_pages(self, file_path: str, page_numbers: List[int]) -> AsyncIterator[Tuple[int, str]]:
+        """
+        OCR the given 1-based pages across the process pool, yielding
+        (page_number, text) in page order as soon as each range completes
+        """
+        loop = asyncio.get_running_loop()
+        # None runs ranges on the loop's thread pool, i.e. in this process
+        executor = _get_executor(self.max_workers) if self.max_workers > 1 else None
+        ranges = iter(self._group_page_ranges(page_numbers))
+        pending: Deque[Tuple[int, asyncio.Future]] = deque()
+
+        def submit_next() -> bool:
+            page_range = next(ranges, None)
+            if page_range is None:
+                return False
+            first_page, last_page = page_range
+            future = loop.run_in_executor(
+                executor,
+                _ocr_page_range,
+                file_path,
+                first_page,
+                last_page,
+                self.language,
+                self.dpi
+            )
+            pending.append((first_page, future))
+            return True
+
+        try:
+            for _ in range(max(1, self.max_pending_tasks)):
+                if not submit_next():
+                    break
+
+            while pending:
+                first_page, future = pending.popleft()
+                texts = await future
+                submit_next()
+                for offset, text in enumerate(texts):
+                    yield first_page + offset, text
+        finally:
+            # Consumer stopped early or failed: drop ranges that have not started
+            for _, future in pending:
+                future.cancel()
+
+    def _group_page_ranges(self, page_numbers: List[int]) -> List[Tuple[int, int]]:
+        """
+        Group page numbers into contiguous ranges of at most pages_per_task pages
+        """
+        ranges = []
+        for page_number in sorted(set(page_numbers)):
+            if ranges:
+                first_page, last_page = ranges[-1]
+                if page_number == last_page + 1 and last_page - first_page + 1 < self.pages_per_task:
+                    ranges[-1] = (first_page, page_number)
+                    continue
+            ranges.append((page_number, page_number))
+        return ranges
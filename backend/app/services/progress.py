@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from dotenv import load_dotenv
+from .cache_service import CacheService, PROGRESS_CHANNEL_PREFIX
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class ProcessingProgress:
+    """
+    Fine-grained progress of one document's processing (pages OCR'd, chunks
+    and analyses complete, partial analysis results). Every update is stored
+    as the document's processing status and published on progress:<document_id>.
+    """
+
+    def __init__(self, cache: CacheService, document_id: str, status: Dict[str, Any]):
+        self.cache = cache
+        self.document_id = document_id
+        self.status = status
+        # Minimum seconds between writes of routine (non-forced) updates
+        self.min_interval = float(os.getenv("PROGRESS_MIN_INTERVAL_SECONDS", "0.5"))
+        self._flushed_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def start(cls, cache: CacheService, document_id: str, analyses_total: int) -> "ProcessingProgress":
+        """
+        Begin tracking a fresh processing run
+        """
+        progress = cls(cache, document_id, {
+            "document_id": document_id,
+            "stage": "extracting",
+            "pages_total": None,
+            "pages_ocr_total": 0,
+            "pages_ocr_done": 0,
+            "chunks": {},
+            "analyses_total": analyses_total,
+            "analyses_done": 0,
+            "partial_results": {}
+        })
+        await progress.update(force=True)
+        return progress
+
+    @classmethod
+    async def load(cls, cache: CacheService, document_id: str) -> "ProcessingProgress":
+        """
+        Resume tracking a run begun by an earlier stage, possibly in another worker
+        """
+        status = await cache.get_processing_status(document_id) or {"document_id": document_id}
+        return cls(cache, document_id, status)
+
+    async def update(self, force: bool = False, **changes):
+        """
+        Apply changes and publish them. Routine updates are rate limited; the
+        latest state is always written by the next forced update.
+        """
+        self.status.update(changes)
+        if not force and time.monotonic() - self._flushed_at < self.min_interval:
+            return
+        async with self._lock:
+            self._flushed_at = time.monotonic()
+            self.status["updated_at"] = datetime.utcnow().isoformat()
+            await self.cache.set_processing_status(self.document_id, self.status, publish=True)
+
+    async def set_stage(self, stage: str, **changes):
+        await self.update(force=True, stage=stage, **changes)
+
+    async def page_ocr_done(self, pages_done: int):
+        total = self.status.get("pages_ocr_total") or 0
+        await self.update(force=pages_done >= total, pages_ocr_done=pages_done)
+
+    async def chunk_done(self, analysis_type: str, chunks_done: int, chunks_total: int):
+        self.status.setdefault("chunks", {})[analysis_type] = {"done": chunks_done, "total": chunks_total}
+        await self.update(force=chunks_done >= chunks_total)
+
+    async def analysis_done(self, result: Dict[str, Any]):
+        self.status.setdefault("partial_results", {})[result["analysis_type"]] = result["result"]
+        self.status["analyses_done"] = len(self.status["partial_results"])
+        await self.update(force=True)
+
+
+class ProgressSubscriber:
+    """
+    Relays published progress of a changing set of documents to a callback,
+    e.g. for one WebSocket connection
+    """
+
+    def __init__(self, cache: CacheService, on_progress: Callable[[str, Dict[str, Any]], Awaitable[None]]):
+        self.pubsub = cache.redis.pubsub()
+        self.on_progress = on_progress
+        self._listener: Optional[asyncio.Task] = None
+
+    async def subscribe(self, document_ids: Iterable[str]):
+        await self.pubsub.subscribe(*[f"{PROGRESS_CHANNEL_PREFIX}{document_id}" for document_id in document_ids])
+        # listen() returns once nothing is subscribed, so restart it as needed
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def unsubscribe(self, document_ids: Iterable[str]):
+        await self.pubsub.unsubscribe(*[f"{PROGRESS_CHANNEL_PREFIX}{document_id}" for document_id in document_ids])
+
+    async def _listen(self):
+        try:
+            async for message in self.pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                document_id = message["channel"][len(PROGRESS_CHANNEL_PREFIX):]
+                await self.on_progress(document_id, json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Progress subscriber failed: {str(e)}")
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+        await self.pubsub.close()
@@ -0,0 +1,298 @@
+import os
+import time
+import heapq
+import asyncio
+import enum
+import itertools
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from .cache_service import get_cache_service
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Token bucket stored in a Redis hash, refilled from Redis server time so all
+# nodes agree. Returns 0 if the cost was taken, otherwise milliseconds to wait.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+redis.replicate_commands()
+local time = redis.call("time")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call("hmget", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill_rate)
+local wait_ms = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait_ms = math.ceil((cost - tokens) / refill_rate * 1000)
+end
+redis.call("hset", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("pexpire", KEYS[1], math.ceil(capacity / refill_rate * 1000) + 1000)
+return wait_ms
+"""
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to capacity tokens, refilled continuously
+    at refill_rate tokens per second
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        if capacity <= 0 or refill_rate <= 0:
+            raise ValueError("capacity and refill_rate must be positive")
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def delay_for(self, amount: float) -> float:
+        """
+        Seconds until amount tokens are available (0 if available now)
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_rate
+
+    def consume(self, amount: float):
+        """
+        Take tokens from the bucket; call only after delay_for returned 0
+        """
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def try_consume(self, amount: float = 1) -> float:
+        """
+        Consume amount tokens if available. Returns 0 on success, otherwise
+        the number of seconds until they will be
+        """
+        delay = self.delay_for(amount)
+        if delay == 0:
+            self.consume(amount)
+        return delay
+
+    def refund(self, amount: float):
+        """
+        Return tokens to the bucket (or take more, if amount is negative)
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class MistralRateLimiter:
+    """
+    Admission control for Mistral requests: requests-per-minute and
+    tokens-per-minute buckets, a cap on in-flight requests, and priority
+    lanes so interactive requests are admitted before queued background work
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_in_flight: int,
+        interactive_reserved_slots: int = 0
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_in_flight = max_in_flight
+        # Slots background requests may not use, so chat is never stuck behind a batch
+        self.interactive_reserved_slots = min(interactive_reserved_slots, max_in_flight - 1)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._queue: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._condition: Optional[asyncio.Condition] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _admission_delay(self, tokens: int, priority: Priority) -> Optional[float]:
+        """
+        Seconds until a request can be admitted, or None if it must wait for a
+        slot to be released
+        """
+        slots = self.max_in_flight
+        if priority != Priority.INTERACTIVE:
+            slots -= self.interactive_reserved_slots
+        if self.in_flight >= slots:
+            return None
+        return max(
+            self.blocked_until - time.monotonic(),
+            self.request_bucket.delay_for(1),
+            self.token_bucket.delay_for(tokens),
+            0.0
+        )
+
+    @asynccontextmanager
+    async def slot(self, tokens: int, priority: Priority = Priority.BACKGROUND) -> AsyncIterator[None]:
+        """
+        Wait for admission of a request expected to use the given number of tokens
+        """
+        ticket = (int(priority), next(self._counter))
+        async with self.condition:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    delay = None
+                    if self._queue[0] == ticket:
+                        delay = self._admission_delay(tokens, priority)
+                        if delay == 0:
+                            break
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self.condition.notify_all()
+
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(tokens)
+            self.in_flight += 1
+
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """
+        Correct the token bucket once the real usage of a request is known
+        """
+        self.token_bucket.refund(estimated_tokens - actual_tokens)
+
+    async def throttle(self, retry_after: float):
+        """
+        Pause admission of all requests, e.g. after a 429 response
+        """
+        async with self.condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.condition.notify_all()
+        logger.warning(f"Mistral rate limited, pausing requests for {retry_after:.1f}s")
+
+
+_limiter: Optional[MistralRateLimiter] = None
+
+
+def get_rate_limiter() -> MistralRateLimiter:
+    """
+    Get the process-wide Mistral rate limiter
+    """
+    global _limiter
+    if _limiter is None:
+        _limiter = MistralRateLimiter(
+            requests_per_minute=int(os.getenv("MISTRAL_REQUESTS_PER_MINUTE", "300")),
+            tokens_per_minute=int(os.getenv("MISTRAL_TOKENS_PER_MINUTE", "2000000")),
+            max_in_flight=int(os.getenv("MISTRAL_MAX_IN_FLIGHT", "16")),
+            interactive_reserved_slots=int(os.getenv("MISTRAL_INTERACTIVE_RESERVED_SLOTS", "2"))
+        )
+    return _limiter
+
+
+class RequestRateLimiter(ABC):
+    """
+    Per-client token buckets limiting inbound requests to per_minute, with
+    bursts of up to per_minute requests
+    """
+
+    def __init__(self, name: str, per_minute: int):
+        self.name = name
+        self.capacity = per_minute
+        self.refill_rate = per_minute / 60
+
+    @abstractmethod
+    async def acquire(self, key: str, cost: float = 1) -> float:
+        """
+        Charge a request to a client. Returns 0 if it is allowed, otherwise
+        the number of seconds until it would be
+        """
+
+
+class InMemoryRequestRateLimiter(RequestRateLimiter):
+    """
+    Buckets held in this process; limits apply per worker
+    """
+
+    def __init__(self, name: str, per_minute: int, max_keys: int = 100000):
+        super().__init__(name, per_minute)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    async def acquire(self, key: str, cost: float = 1) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, self.refill_rate)
+            # Forget the least recently seen clients; they start again with a full bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.try_consume(cost)
+
+
+class RedisRequestRateLimiter(RequestRateLimiter):
+    """
+    Buckets held in Redis; limits apply across all workers and nodes
+    """
+
+    def __init__(self, name: str, per_minute: int):
+        super().__init__(name, per_minute)
+        self.redis = get_cache_service().redis
+
+    async def acquire(self, key: str, cost: float = 1) -> float:
+        try:
+            wait_ms = await self.redis.eval(
+                TOKEN_BUCKET_SCRIPT, 1, f"rate_limit:{self.name}:{key}",
+                self.capacity, self.refill_rate, cost
+            )
+            return int(wait_ms) / 1000
+        except Exception as e:
+            # Fail open: an unavailable Redis should not take the API down with it
+            logger.error(f"Error checking rate limit {self.name}: {str(e)}")
+            return 0.0
+
+
+_request_limiters: Dict[str, RequestRateLimiter] = {}
+
+
+def get_request_rate_limiter(name: str, per_minute: int) -> RequestRateLimiter:
+    """
+    Get the process-wide request rate limiter with the given name, backed by
+    RATE_LIMIT_BACKEND ("redis" or "memory")
+    """
+    if name not in _request_limiters:
+        backend = os.getenv("RATE_LIMIT_BACKEND", "redis").lower()
+        if backend == "memory":
+            _request_limiters[name] = InMemoryRequestRateLimiter(name, per_minute)
+        elif backend == "redis":
+            _request_limiters[name] = RedisRequestRateLimiter(name, per_minute)
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+    return _request_limiters[name]
@@ -0,0 +1,109 @@
+import os
+import uuid
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+from .cache_service import CacheService, LeaseError
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key: callers in this process
+    share one in-flight computation, and across processes a Redis lease lets
+    one holder compute while the others wait for its cached result
+    """
+
+    def __init__(self, cache: CacheService):
+        self.cache = cache
+        self.lease_ttl = timedelta(seconds=int(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "120")))
+        self.poll_interval = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "1.0"))
+        self.wait_timeout = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "1800"))
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        load: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Any:
+        """
+        Return load()'s result if available, otherwise compute it exactly once.
+        compute is expected to store its result where load can find it.
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_with_lease(key, compute, load)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when no other caller is waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _run_with_lease(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        load: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Any:
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+        token = uuid.uuid4().hex
+
+        while True:
+            result = await load()
+            if result is not None:
+                return result
+
+            try:
+                acquired = await self.cache.acquire_lease(key, token, self.lease_ttl)
+            except LeaseError:
+                # Without Redis there is no one to wait for; computing here beats
+                # polling until the wait timeout
+                logger.warning(f"Lease for {key} unavailable, computing without coalescing")
+                return await compute()
+
+            if acquired:
+                try:
+                    # Another holder may have finished between our load and acquire
+                    result = await load()
+                    if result is not None:
+                        return result
+                    return await self._compute_holding_lease(key, token, compute)
+                finally:
+                    await self.cache.release_lease(key, token)
+
+            if asyncio.get_running_loop().time() >= deadline:
+                raise TimeoutError(f"Timed out waiting for in-flight computation of {key}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _compute_holding_lease(self, key: str, token: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run compute while periodically renewing the lease so it outlives slow computations
+        """
+        async def renew():
+            while True:
+                await asyncio.sleep(self.lease_ttl.total_seconds() / 3)
+                if not await self.cache.renew_lease(key, token, self.lease_ttl):
+                    logger.warning(f"Lost single-flight lease for {key}")
+                    return
+
+        renewal = asyncio.create_task(renew())
+        try:
+            return await compute()
+        finally:
+            renewal.cancel()
@@ -0,0 +1,230 @@
+import re
+import logging
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+except ImportError:  # pragma: no cover - optional dependency
+    MistralTokenizer = None
+
+# Used when the model tokenizer is unavailable
+CHARS_PER_TOKEN = 4
+
+# Lines that start a new clause or section in legal documents. Numbered
+# headings need real heading syntax ("7. Term", "7) Term", "7.2 Term"), so
+# hard-wrapped lines such as "30 days after signing" are not mistaken for one.
+SECTION_BOUNDARY = re.compile(
+    r"^\s*(?:"
+    r"(?:ARTICLE|Article|SECTION|Section|CLAUSE|Clause|SCHEDULE|Schedule|EXHIBIT|Exhibit|§)\s*[\dIVXLCivxlc]+"
+    r"|\d+(?:\.\d+)*[.)]\s+[A-Z]"
+    r"|\d+(?:\.\d+)+\s+[A-Z]"
+    r"|\([a-z0-9]{1,4}\)\s+\S"
+    r")"
+)
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.;:!?])\s+")
+
+
+@lru_cache(maxsize=8)
+def get_token_counter(model: Optional[str] = None) -> Callable[[str], int]:
+    """
+    Get a token counting function for a model, falling back to a character
+    based estimate when the model tokenizer is not installed
+    """
+    if MistralTokenizer is not None and model:
+        try:
+            tokenizer = MistralTokenizer.from_model(model).instruct_tokenizer.tokenizer
+            return lambda text: len(tokenizer.encode(text, bos=False, eos=False))
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer for {model}, estimating tokens: {str(e)}")
+    return lambda text: len(text) // CHARS_PER_TOKEN + 1
+
+
+class TextChunker:
+    """
+    Split text into chunks of at most max_tokens tokens, preferring clause and
+    section boundaries, with optional overlap between consecutive chunks
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4000,
+        overlap_tokens: int = 0,
+        model: Optional[str] = None,
+        token_counter: Optional[Callable[[str], int]] = None
+    ):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        if overlap_tokens < 0 or overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be between 0 and max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = token_counter or get_token_counter(model)
+        # Break early at a section heading once a chunk is at least this full
+        self.min_fill_tokens = max_tokens // 2
+
+    def split(self, text: str) -> List[str]:
+        """
+        Split text into chunks
+        """
+        segments = self._segments(text)
+        chunks: List[str] = []
+        current: List[Tuple[str, int]] = []
+        current_tokens = 0
+
+        for segment, tokens, is_heading in segments:
+            starts_section = is_heading and current_tokens >= self.min_fill_tokens
+            if current and (current_tokens + tokens > self.max_tokens or starts_section):
+                chunks.append("\n\n".join(part for part, _ in current))
+                current = self._overlap(current)
+                current_tokens = sum(part_tokens for _, part_tokens in current)
+                # Overlap must never push the next segment over budget
+                while current and current_tokens + tokens > self.max_tokens:
+                    current_tokens -= current.pop(0)[1]
+            current.append((segment, tokens))
+            current_tokens += tokens
+
+        if current:
+            chunks.append("\n\n".join(part for part, _ in current))
+        return chunks
+
+    def _segments(self, text: str) -> List[Tuple[str, int, bool]]:
+        """
+        Break text into (segment, tokens, is_heading) units no larger than max_tokens
+        """
+        segments = []
+        for paragraph in self._paragraphs(text):
+            tokens = self.count_tokens(paragraph)
+            is_heading = bool(SECTION_BOUNDARY.match(paragraph))
+            if tokens <= self.max_tokens:
+                segments.append((paragraph, tokens, is_heading))
+                continue
+            for index, piece in enumerate(self._split_oversized(paragraph)):
+                segments.append((piece, self.count_tokens(piece), is_heading and index == 0))
+        return segments
+
+    def _paragraphs(self, text: str) -> List[str]:
+        """
+        Split text into paragraphs, also breaking before section headings that
+        are only separated by a single newline
+        """
+        paragraphs = []
+        for block in PARAGRAPH_BREAK.split(text):
+            lines: List[str] = []
+            for line in block.split("\n"):
+                if lines and SECTION_BOUNDARY.match(line):
+                    paragraphs.append("\n".join(lines).strip())
+                    lines = []
+                lines.append(line)
+            if lines:
+                paragraphs.append("\n".join(lines).strip())
+        return [paragraph for paragraph in paragraphs if paragraph]
+
+    def _split_oversized(self, paragraph: str) -> List[str]:
+        """
+        Split a paragraph larger than max_tokens at sentence boundaries, and
+        split any single sentence that is still too large by words
+        """
+        pieces: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        for sentence in SENTENCE_BREAK.split(paragraph):
+            tokens = self.count_tokens(sentence)
+            if tokens > self.max_tokens:
+                if current:
+                    pieces.append(" ".join(current))
+                    current, current_tokens = [], 0
+                pieces.extend(self._split_words(sentence))
+                continue
+            if current and current_tokens + tokens > self.max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(sentence)
+            current_tokens += tokens
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+    def _split_words(self, sentence: str) -> List[str]:
+        """
+        Split a run of text by words so that each piece fits max_tokens,
+        hard-splitting any single word that is too large on its own
+        """
+        pieces: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        for word in sentence.split():
+            tokens = self.count_tokens(word + " ")
+            if tokens > self.max_tokens:
+                if current:
+                    pieces.append(" ".join(current))
+                    current, current_tokens = [], 0
+                pieces.extend(self._split_characters(word))
+                continue
+            if current and current_tokens + tokens > self.max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += tokens
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+    def _split_characters(self, word: str) -> List[str]:
+        """
+        Split a run without whitespace (e.g. a long URL or base64 blob) into
+        the longest prefixes that fit max_tokens
+        """
+        pieces: List[str] = []
+        while word:
+            low, high = 1, len(word)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.count_tokens(word[:middle]) <= self.max_tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            pieces.append(word[:low])
+            word = word[low:]
+        return pieces
+
+    def _overlap(self, parts: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """
+        Get the trailing segments of a chunk that fit in the overlap budget
+        """
+        if not self.overlap_tokens:
+            return []
+        overlap: List[Tuple[str, int]] = []
+        total = 0
+        for part, tokens in reversed(parts):
+            if total + tokens > self.overlap_tokens:
+                break
+            overlap.insert(0, (part, tokens))
+            total += tokens
+        return overlap
+
+
+if __name__ == "__main__":
+    # Benchmark: python -m app.services.text_chunker <file> [max_tokens] [overlap_tokens] [model]
+    import sys
+    import time
+
+    with open(sys.argv[1], encoding="utf-8") as benchmark_file:
+        benchmark_text = benchmark_file.read()
+    chunker = TextChunker(
+        max_tokens=int(sys.argv[2]) if len(sys.argv) > 2 else 4000,
+        overlap_tokens=int(sys.argv[3]) if len(sys.argv) > 3 else 200,
+        model=sys.argv[4] if len(sys.argv) > 4 else None
+    )
+    started = time.perf_counter()
+    benchmark_chunks = chunker.split(benchmark_text)
+    elapsed = time.perf_counter() - started
+    chunk_tokens = [chunker.count_tokens(chunk) for chunk in benchmark_chunks]
+    print(
+        f"{len(benchmark_text)} chars -> {len(benchmark_chunks)} chunks in {elapsed * 1000:.1f} ms "
+        f"({len(benchmark_text) / max(elapsed, 1e-9) / 1e6:.1f} MB/s); "
+        f"tokens per chunk min={min(chunk_tokens, default=0)} max={max(chunk_tokens, default=0)}"
+    )
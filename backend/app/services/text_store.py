@@ -0,0 +1,119 @@
+import os
+import gzip
+import json
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+import aiofiles
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+class TextStore:
+    """
+    Gzip-compressed on-disk store of extracted document text, keyed by the
+    SHA-256 hash of the source file so identical uploads share one entry
+    """
+
+    def __init__(self):
+        upload_dir = os.getenv('UPLOAD_DIR', './uploads')
+        self.store_dir = Path(os.getenv('TEXT_STORE_DIR', os.path.join(upload_dir, 'text')))
+        self.compression_level = int(os.getenv('TEXT_STORE_COMPRESSION_LEVEL', '6'))
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, file_hash: str, artifact: Optional[str] = None) -> Path:
+        # Shard by hash prefix to keep directories small
+        name = f"{file_hash}.{artifact}.json.gz" if artifact else f"{file_hash}.txt.gz"
+        return self.store_dir / file_hash[:2] / name
+
+    async def get(self, file_hash: str) -> Optional[str]:
+        """
+        Get stored text for a file hash
+        """
+        return await self._read(self._path(file_hash))
+
+    async def put(self, file_hash: str, text: str):
+        """
+        Store text for a file hash, replacing any existing entry atomically
+        """
+        await self._write(self._path(file_hash), text)
+
+    async def get_artifact(self, file_hash: str, artifact: str) -> Optional[Any]:
+        """
+        Get an intermediate processing artifact (e.g. per-page text or chunks) for a file hash
+        """
+        data = await self._read(self._path(file_hash, artifact))
+        return json.loads(data) if data is not None else None
+
+    async def put_artifact(self, file_hash: str, artifact: str, value: Any):
+        """
+        Store an intermediate processing artifact for a file hash
+        """
+        await self._write(self._path(file_hash, artifact), json.dumps(value))
+
+    async def delete_artifact(self, file_hash: str, artifact: str):
+        """
+        Remove an intermediate processing artifact
+        """
+        self._unlink(self._path(file_hash, artifact))
+
+    async def _read(self, path: Path) -> Optional[str]:
+        try:
+            async with aiofiles.open(path, 'rb') as file:
+                compressed = await file.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading stored text {path.name}: {str(e)}")
+            return None
+
+        try:
+            data = await asyncio.to_thread(gzip.decompress, compressed)
+            return data.decode('utf-8')
+        except Exception as e:
+            logger.error(f"Corrupt stored text {path.name}, discarding: {str(e)}")
+            self._unlink(path)
+            return None
+
+    async def _write(self, path: Path, text: str):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            compressed = await asyncio.to_thread(
+                gzip.compress,
+                text.encode('utf-8'),
+                self.compression_level
+            )
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            os.close(fd)
+            try:
+                async with aiofiles.open(tmp_path, 'wb') as file:
+                    await file.write(compressed)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except Exception as e:
+            logger.error(f"Error storing text {path.name}: {str(e)}")
+
+    async def exists(self, file_hash: str) -> bool:
+        """
+        Check whether text is stored for a file hash
+        """
+        return self._path(file_hash).exists()
+
+    async def delete(self, file_hash: str):
+        """
+        Remove stored text for a file hash
+        """
+        self._unlink(self._path(file_hash))
+
+    def _unlink(self, path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error deleting stored text {path.name}: {str(e)}")
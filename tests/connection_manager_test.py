@@ -0,0 +1,157 @@
+import unittest
+import asyncio
+import json
+import sys
+import os
+from unittest import mock
+
+# Add backend to Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app.services.backplane import InMemoryBackplane
+from app.services.connection_manager import ConnectionManager, SLOW_CONSUMER_CLOSE_CODE
+
+class FakeWebSocket:
+    """
+    Records the frames sent to a client; a blocked socket never finishes a send
+    """
+
+    def __init__(self, blocked: bool = False):
+        self.sent = []
+        self.closed_with = None
+        self.blocked = blocked
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.blocked:
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+    def frames(self, frame_type: str):
+        return [frame for frame in self.sent if frame["type"] == frame_type]
+
+class TestConnectionManager(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        """
+        Two "nodes" relaying through one in-memory backplane
+        """
+        environment = mock.patch.dict(os.environ, {'WS_TYPING_DEBOUNCE_MS': '0', 'WS_SEND_QUEUE_SIZE': '4'})
+        environment.start()
+        self.addCleanup(environment.stop)
+        self.backplane = InMemoryBackplane()
+        self.node1 = ConnectionManager(self.backplane)
+        self.node2 = ConnectionManager(self.backplane)
+
+    async def asyncTearDown(self):
+        await self.node1.close()
+        await self.node2.close()
+
+    async def settle(self):
+        # Let writer tasks and debounced flushes run
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    async def test_broadcast_reaches_other_node(self):
+        """
+        A broadcast on one node is delivered to clients of every node
+        """
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        await self.node1.connect(alice, 'alice', 'user-1')
+        await self.node2.connect(bob, 'bob', 'user-2')
+
+        await self.node1.broadcast_message('maintenance at noon')
+        await self.settle()
+
+        self.assertEqual(alice.frames('broadcast'), [{'type': 'broadcast', 'content': 'maintenance at noon'}])
+        self.assertEqual(bob.frames('broadcast'), [{'type': 'broadcast', 'content': 'maintenance at noon'}])
+
+    async def test_room_join_and_leave_across_nodes(self):
+        """
+        Room members on both nodes see joins and leaves; other rooms see nothing
+        """
+        alice, bob, carol = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await self.node1.connect(alice, 'alice', 'user-1')
+        await self.node2.connect(bob, 'bob', 'user-2')
+        await self.node2.connect(carol, 'carol', 'user-3')
+
+        await self.node1.join_room('alice', 'conversation:1')
+        await self.node2.join_room('bob', 'conversation:1')
+        await self.node2.join_room('carol', 'conversation:2')
+        await self.settle()
+
+        self.assertEqual(alice.frames('presence')[-1]['members'], ['alice', 'bob'])
+        self.assertEqual(self.node1.room_members('conversation:1'), {'alice', 'bob'})
+        self.assertEqual(self.node2.room_members('conversation:1'), {'alice', 'bob'})
+
+        await self.node2.leave_room('bob', 'conversation:1')
+        await self.settle()
+
+        left = alice.frames('presence')[-1]
+        self.assertEqual((left['client_id'], left['status'], left['members']), ('bob', 'left', ['alice']))
+        self.assertEqual(self.node1.room_members('conversation:1'), {'alice'})
+        self.assertFalse(any(frame['room'] == 'conversation:1' for frame in carol.frames('presence')))
+
+    async def test_disconnect_leaves_rooms_on_other_nodes(self):
+        """
+        A disconnected client is removed from its rooms on every node
+        """
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        await self.node1.connect(alice, 'alice', 'user-1')
+        await self.node2.connect(bob, 'bob', 'user-2')
+        await self.node1.join_room('alice', 'document:7')
+        await self.node2.join_room('bob', 'document:7')
+
+        self.node1.disconnect(alice, 'alice')
+        await self.settle()
+
+        self.assertEqual(self.node2.room_members('document:7'), {'bob'})
+        self.assertEqual(bob.frames('presence')[-1]['status'], 'left')
+
+    async def test_late_node_receives_room_snapshot(self):
+        """
+        A node that starts after rooms were joined learns their members
+        """
+        alice = FakeWebSocket()
+        await self.node1.connect(alice, 'alice', 'user-1')
+        await self.node1.join_room('alice', 'conversation:1')
+
+        late_node = ConnectionManager(self.backplane)
+        try:
+            await late_node.connect(FakeWebSocket(), 'bob', 'user-2')
+            await self.settle()
+            self.assertEqual(late_node.room_members('conversation:1'), {'alice'})
+        finally:
+            await late_node.close()
+
+    async def test_slow_consumer_is_closed(self):
+        """
+        A client that stops reading is disconnected once its queue is full,
+        without holding up other clients
+        """
+        slow, fast = FakeWebSocket(blocked=True), FakeWebSocket()
+        await self.node1.connect(slow, 'slow', 'user-1')
+        await self.node2.connect(fast, 'fast', 'user-2')
+
+        for index in range(10):
+            await self.node1.broadcast_message(f'message {index}')
+            await self.settle()
+
+        self.assertEqual(slow.closed_with, SLOW_CONSUMER_CLOSE_CODE)
+        self.assertNotIn('slow', self.node1.active_connections)
+        self.assertEqual(len(fast.frames('broadcast')), 10)
+
+    async def test_client_id_of_another_user_is_rejected(self):
+        """
+        A client id in use by one user cannot be taken over by another
+        """
+        await self.node1.connect(FakeWebSocket(), 'shared', 'user-1')
+        with self.assertRaises(PermissionError):
+            await self.node1.connect(FakeWebSocket(), 'shared', 'user-2')
+
+if __name__ == '__main__':
+    unittest.main()
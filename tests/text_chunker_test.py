@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+
+# Add backend to Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app.services.text_chunker import TextChunker
+
+class TestTextChunker(unittest.TestCase):
+    def setUp(self):
+        self.chunker = TextChunker(max_tokens=50)
+
+    def assertWithinBudget(self, chunks):
+        for chunk in chunks:
+            self.assertLessEqual(self.chunker.count_tokens(chunk), self.chunker.max_tokens)
+
+    def test_split_preserves_short_text(self):
+        """
+        Text within the budget comes back as a single chunk
+        """
+        self.assertEqual(self.chunker.split("A short clause."), ["A short clause."])
+
+    def test_split_long_sentence_by_words(self):
+        """
+        A sentence larger than the budget is split between words
+        """
+        chunks = self.chunker.split(" ".join(["word"] * 200))
+        self.assertGreater(len(chunks), 1)
+        self.assertWithinBudget(chunks)
+
+    def test_split_run_without_whitespace(self):
+        """
+        A run with no whitespace larger than the budget is hard-split
+        """
+        text = "x" * 1000
+        chunks = self.chunker.split(text)
+        self.assertGreater(len(chunks), 1)
+        self.assertWithinBudget(chunks)
+        self.assertEqual("".join(chunks), text)
+
+    def test_split_long_word_between_words(self):
+        """
+        Words around an oversized run are kept intact
+        """
+        chunks = self.chunker.split("before " + "y" * 1000 + " after")
+        self.assertWithinBudget(chunks)
+        self.assertEqual(chunks[0], "before")
+        self.assertEqual(chunks[-1].split()[-1], "after")
+
+    def test_wrapped_numeric_lines_are_not_headings(self):
+        """
+        Hard-wrapped lines that begin with a number stay in their paragraph
+        """
+        text = (
+            "The Buyer shall pay the Price within\n"
+            "30 days of signing the Agreement, and\n"
+            "100 percent of the deposit is refundable."
+        )
+        self.assertEqual(self.chunker._paragraphs(text), [text])
+
+    def test_numbered_headings_start_paragraphs(self):
+        """
+        Numbered and keyword headings start a new paragraph even after a single newline
+        """
+        text = "1. Definitions\nTerms apply.\n2) Term\n3.1 Renewal\nSection 4 Notices"
+        self.assertEqual(
+            self.chunker._paragraphs(text),
+            ["1. Definitions\nTerms apply.", "2) Term", "3.1 Renewal", "Section 4 Notices"]
+        )
+
+if __name__ == '__main__':
+    unittest.main()